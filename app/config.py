@@ -1,9 +1,9 @@
 """Конфигурация приложения"""
 
-from pydantic_settings import BaseSettings
+from functools import lru_cache
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import HttpUrl
-from typing import List
-import os
 
 
 class Settings(BaseSettings):
@@ -17,13 +17,16 @@ class Settings(BaseSettings):
     # Прокси настройки
     proxy_host: str = "0.0.0.0"
     proxy_port: int = 8000
-    proxy_workers: int = 4
+    proxy_workers: int = 4  # Рекомендуется 2*CPU+1 для I/O-bound нагрузки
     
     # Кэширование
     cache_ttl: int = 300  # 5 минут
     cache_max_size: int = 1000
     enable_cache: bool = True
     
+    # Документация (docs/redoc/openapi роуты; выключено в продакшене)
+    enable_docs: bool = False
+
     # Логирование
     log_level: str = "INFO"
     log_format: str = "json"  # json или text
@@ -37,11 +40,42 @@ class Settings(BaseSettings):
     max_response_size: int = 10 * 1024 * 1024  # 10MB
     max_filter_fetch_size: int = 2000  # Максимальное количество записей для загрузки при фильтрации
     filter_fetch_multiplier: int = 20  # Множитель для определения количества загружаемых записей (count * multiplier)
+    upstream_concurrency: int = 8  # Максимум одновременных запросов страниц к upstream API
+    upstream_max_concurrent: int = 32  # Потолок одновременных запросов к upstream (backpressure)
+    trust_upstream: bool = False  # Строить модели списков без повторной валидации ответа upstream
     
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
+    model_config = SettingsConfigDict(env_file=".env", case_sensitive=False)
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Возвращает единственный экземпляр настроек.
+
+    Ленивая инициализация: чтение .env и валидация выполняются при первом
+    обращении, а не при импорте модуля (важно для воркеров и тестов).
+    """
+    return Settings()
+
+
+# Горячие read-only значения настроек как константы модуля: доступ к атрибуту
+# pydantic-модели на каждый запрос дороже, чем LOAD_GLOBAL. Вычисляются лениво
+# через PEP 562 __getattr__ при первом обращении и кэшируются в globals().
+_HOT_SETTINGS = {
+    "LOG_LEVEL": lambda s: s.log_level.upper(),
+    "UPSTREAM_BASE_URL": lambda s: str(s.upstream_base_url),
+    "MAX_RESPONSE_SIZE": lambda s: s.max_response_size,
+    "CACHE_TTL": lambda s: s.cache_ttl,
+    "MAX_FILTER_FETCH_SIZE": lambda s: s.max_filter_fetch_size,
+    "FILTER_FETCH_MULTIPLIER": lambda s: s.filter_fetch_multiplier,
+    "TRUST_UPSTREAM": lambda s: s.trust_upstream,
+}
 
 
-# Глобальный экземпляр настроек
-settings = Settings()
\ No newline at end of file
+def __getattr__(name: str):
+    try:
+        factory = _HOT_SETTINGS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = factory(get_settings())
+    globals()[name] = value
+    return value
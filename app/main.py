@@ -1,29 +1,40 @@
 """Основное FastAPI приложение для SCIM Proxy Service"""
 
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 import logging
+import queue
 import sys
 import time
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 
-from .config import settings
+from .config import get_settings
 from .routers import users_router, groups_router, health_router, service_provider_config_router, resource_types_router
 from .services.proxy import proxy_service
 from .utils.exceptions import SCIMProxyError
 from .models.scim import SCIMError
 
 
-# Настройка логирования
-logging.basicConfig(
-    level=getattr(logging, settings.log_level.upper()),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout)
-    ]
+settings = get_settings()
+
+# Настройка логирования: записи уходят в очередь, а форматирование и вывод
+# в stdout выполняет фоновый QueueListener — event loop не блокируется на I/O
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 )
 
+_log_listener = QueueListener(_log_queue, _stream_handler)
+_log_listener.start()
+
+_root_logger = logging.getLogger()
+_root_logger.setLevel(getattr(logging, settings.log_level.upper()))
+_root_logger.addHandler(QueueHandler(_log_queue))
+
 logger = logging.getLogger(__name__)
 
 
@@ -32,13 +43,16 @@ async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
     # Startup
     logger.info("Starting SCIM Proxy Service...")
-    logger.info(f"Upstream URL: {settings.upstream_base_url}")
-    
+    logger.info("Upstream URL: %s", settings.upstream_base_url)
+    # Прогреваем пул соединений, чтобы первый запрос не платил за handshake
+    await proxy_service.warmup()
+
     yield
     
     # Shutdown
     logger.info("Shutting down SCIM Proxy Service...")
     await proxy_service.close()
+    _log_listener.stop()
 
 
 # Создание FastAPI приложения
@@ -46,27 +60,58 @@ app = FastAPI(
     title="SCIM Proxy Service",
     description="Высокопроизводительный прокси для модернизации SCIM API с поддержкой фильтров",
     version="1.0.0",
-    docs_url="/docs",
-    redoc_url="/redoc",
+    docs_url="/docs" if settings.enable_docs else None,
+    redoc_url="/redoc" if settings.enable_docs else None,
+    openapi_url="/openapi.json" if settings.enable_docs else None,
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
 # Настройка CORS
-cors_origins = settings.cors_origins.split(",") if settings.cors_origins != "*" else ["*"]
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=cors_origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class WildcardCORSMiddleware:
+    """ASGI middleware для wildcard CORS конфигурации.
+
+    Прогоняет через CORSMiddleware только preflight OPTIONS запросы;
+    остальные запросы идут напрямую, минуя диспетчеризацию CORSMiddleware
+    на каждый запрос.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._cors = CORSMiddleware(
+            app,
+            allow_origins=["*"],
+            allow_credentials=True,
+            allow_methods=["*"],
+            allow_headers=["*"],
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "OPTIONS":
+            await self._cors(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+if settings.cors_origins == "*" and settings.allowed_hosts == "*":
+    # Wildcard-конфигурация: CORS нужен только для preflight запросов
+    app.add_middleware(WildcardCORSMiddleware)
+else:
+    cors_origins = settings.cors_origins.split(",")
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
 
 
 # Обработчик исключений SCIM Proxy
 @app.exception_handler(SCIMProxyError)
 async def scim_proxy_exception_handler(request: Request, exc: SCIMProxyError):
     """Обработчик кастомных исключений SCIM Proxy"""
-    logger.error(f"SCIM Proxy Error: {exc.message}")
+    logger.error("SCIM Proxy Error: %s", exc.message)
     
     error_response = SCIMError(
         status=exc.status_code,
@@ -74,9 +119,10 @@ async def scim_proxy_exception_handler(request: Request, exc: SCIMProxyError):
         detail=exc.message
     )
     
-    return JSONResponse(
+    return Response(
+        content=error_response.model_dump_json(),
         status_code=exc.status_code,
-        content=error_response.dict()
+        media_type="application/json"
     )
 
 
@@ -84,79 +130,129 @@ async def scim_proxy_exception_handler(request: Request, exc: SCIMProxyError):
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """Обработчик HTTP исключений"""
-    logger.error(f"HTTP Error: {exc.detail}")
+    logger.error("HTTP Error: %s", exc.detail)
     
     error_response = SCIMError(
         status=exc.status_code,
         detail=str(exc.detail)
     )
     
-    return JSONResponse(
+    return Response(
+        content=error_response.model_dump_json(),
         status_code=exc.status_code,
-        content=error_response.dict()
+        media_type="application/json"
     )
 
 
+# Предсобранный payload для 500: форма ответа статична, поэтому модель
+# и сериализация на этом пути не нужны вовсе
+_INTERNAL_ERROR_BYTES = SCIMError(
+    status=500,
+    detail="Internal server error"
+).model_dump_json().encode()
+
+
 # Обработчик неожиданных исключений
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     """Обработчик неожиданных исключений"""
-    logger.error(f"Unexpected error: {str(exc)}", exc_info=True)
-    
-    error_response = SCIMError(
-        status=500,
-        detail="Internal server error"
-    )
-    
-    return JSONResponse(
+    # Полный traceback (обход фреймов, чтение исходников) — только в DEBUG:
+    # при шторме ошибок от upstream его форматирование само становится узким местом
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.exception("Unexpected error: %s", exc)
+    else:
+        logger.error("Unexpected error: %s", exc)
+
+    return Response(
+        content=_INTERNAL_ERROR_BYTES,
         status_code=500,
-        content=error_response.dict()
+        media_type="application/json"
     )
 
 
-# Middleware для логирования запросов
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    """Middleware для логирования HTTP запросов"""
-    start_time = time.time()
-    
-    # Логируем входящий запрос
-    logger.info(f"Request: {request.method} {request.url}")
-    
-    response = await call_next(request)
-    
-    # Логируем время выполнения
-    process_time = time.time() - start_time
-    logger.info(f"Response: {response.status_code} - {process_time:.3f}s")
-    
-    return response
+# Middleware для логирования запросов (чистый ASGI, без BaseHTTPMiddleware)
+class AccessLogMiddleware:
+    """ASGI middleware для логирования HTTP запросов.
+
+    Работает напрямую со scope/send без создания объектов Request/Response,
+    в отличие от @app.middleware("http"), который оборачивает каждый запрос
+    в BaseHTTPMiddleware с дополнительной задачей.
+    """
+
+    # Служебные пути логируем на уровне DEBUG, чтобы не засорять логи под нагрузкой
+    QUIET_PATHS = ("/health", "/docs", "/redoc", "/openapi.json")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        path = scope["path"]
+        log = logger.debug if path.startswith(self.QUIET_PATHS) else logger.info
+        start_time = time.perf_counter()
+
+        # Логируем входящий запрос (ленивое %-форматирование)
+        log("Request: %s %s", method, path)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Логируем время выполнения
+                process_time = time.perf_counter() - start_time
+                log("Response: %d - %.3fs", message["status"], process_time)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# Middleware для поддержки SCIM v2 префикса без дублирования роутеров
+class V2PathRewriteMiddleware:
+    """ASGI middleware, срезающий префикс /v2 до диспетчеризации.
+
+    Позволяет регистрировать каждый роутер один раз: запросы /v2/Users и
+    /Users попадают на один и тот же маршрут, а список маршрутов Starlette,
+    сканируемый на каждый запрос, не удваивается.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            path = scope["path"]
+            if path == "/v2" or path.startswith("/v2/"):
+                scope["path"] = path[3:] or "/"
+                raw_path = scope.get("raw_path")
+                if raw_path is not None:
+                    scope["raw_path"] = raw_path[3:] or b"/"
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(AccessLogMiddleware)
+app.add_middleware(V2PathRewriteMiddleware)
 
 
 # Подключение роутеров
 app.include_router(health_router)
 
-# Подключаем роутеры с различными префиксами для максимальной совместимости:
-# 1. Основной SCIM v2 путь (без /scim префикса)
-app.include_router(users_router, prefix="/v2")
-app.include_router(groups_router, prefix="/v2")
-app.include_router(service_provider_config_router, prefix="/v2")
-app.include_router(resource_types_router, prefix="/v2")
-
-# 2. Без префикса для обратной совместимости
-app.include_router(users_router)
-app.include_router(groups_router)
-app.include_router(service_provider_config_router)
-app.include_router(resource_types_router)
+# SCIM роутеры регистрируются один раз; пути /v2/* обслуживаются
+# через V2PathRewriteMiddleware для обратной совместимости
+for scim_router in (users_router, groups_router, service_provider_config_router, resource_types_router):
+    app.include_router(scim_router)
 
 
 if __name__ == "__main__":
     import uvicorn
-    import time
-    
+
     uvicorn.run(
         "app.main:app",
         host=settings.proxy_host,
         port=settings.proxy_port,
-        reload=True,
+        workers=settings.proxy_workers,
+        loop="uvloop",
+        http="httptools",
         log_level=settings.log_level.lower()
     )
\ No newline at end of file
@@ -1,6 +1,8 @@
 """Модели для SCIM фильтров"""
 
-from pydantic import BaseModel
+from __future__ import annotations
+
+from dataclasses import dataclass
 from typing import Optional, Any
 from enum import Enum
 
@@ -26,60 +28,67 @@ class LogicalOperator(str, Enum):
     NOT = "not"
 
 
-class FilterExpression(BaseModel):
+# Таблицы для быстрого поиска операторов по токену:
+# dict.get — одна хэш-операция на уровне C вместо медленного EnumMeta.__call__
+_FILTER_OP_BY_TOKEN = {op.value: op for op in FilterOperator}
+_LOGICAL_OP_BY_TOKEN = {op.value: op for op in LogicalOperator}
+
+lookup_filter_op = _FILTER_OP_BY_TOKEN.get
+lookup_logical_op = _LOGICAL_OP_BY_TOKEN.get
+
+
+# Выражения фильтра — легковесные value-объекты: создаются при каждом парсинге
+# и не пересекают границу API, поэтому валидация pydantic здесь не нужна.
+# frozen=True делает их хэшируемыми (для мемоизации), slots экономит память.
+@dataclass(frozen=True, slots=True)
+class FilterExpression:
     """Базовый класс для выражений фильтра"""
-    
-    class Config:
-        extra = "forbid"
 
 
+@dataclass(frozen=True, slots=True)
 class AttributeExpression(FilterExpression):
     """Выражение для атрибута: attribute operator value"""
     attribute: str
     operator: FilterOperator
     value: Optional[Any] = None
-    
+
     def __str__(self):
         if self.operator == FilterOperator.PR:
             return f"{self.attribute} pr"
         return f"{self.attribute} {self.operator} {repr(self.value)}"
 
 
+@dataclass(frozen=True, slots=True)
 class LogicalExpression(FilterExpression):
     """Логическое выражение: left AND/OR right или NOT expression"""
     operator: LogicalOperator
-    left: Optional["FilterExpression"] = None
-    right: Optional["FilterExpression"] = None
-    
+    left: Optional[FilterExpression] = None
+    right: Optional[FilterExpression] = None
+
     def __str__(self):
         if self.operator == LogicalOperator.NOT:
             return f"not ({self.left})"
         return f"({self.left} {self.operator} {self.right})"
 
 
+@dataclass(frozen=True, slots=True)
 class GroupExpression(FilterExpression):
     """Группированное выражение: (expression)"""
-    expression: "FilterExpression"
-    
+    expression: FilterExpression
+
     def __str__(self):
         return f"({self.expression})"
 
 
+@dataclass(frozen=True, slots=True)
 class ComplexAttributeExpression(FilterExpression):
     """Сложное выражение для массивов: emails[type eq "work"].value"""
     attribute: str  # emails
-    filter_expression: "FilterExpression"  # type eq "work"
+    filter_expression: FilterExpression  # type eq "work"
     sub_attribute: Optional[str] = None  # value
-    
+
     def __str__(self):
         result = f"{self.attribute}[{self.filter_expression}]"
         if self.sub_attribute:
             result += f".{self.sub_attribute}"
         return result
-
-
-# Обновляем модели для поддержки forward references
-FilterExpression.model_rebuild()
-LogicalExpression.model_rebuild()
-GroupExpression.model_rebuild()
-ComplexAttributeExpression.model_rebuild()
\ No newline at end of file
@@ -1,19 +1,18 @@
 """SCIM модели данных согласно RFC 7644"""
 
-from pydantic import BaseModel, Field, validator
-from typing import Optional, List, Dict, Any, Union
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, List, Dict, Any, Union, Final
 from datetime import datetime
-from enum import Enum
 
 
-class SCIMSchema(str, Enum):
-    """SCIM схемы"""
-    USER = "urn:ietf:params:scim:schemas:core:2.0:User"
-    LIST_RESPONSE = "urn:ietf:params:scim:api:messages:2.0:ListResponse"
-    PATCH_OP = "urn:ietf:params:scim:api:messages:2.0:PatchOp"
-    ERROR = "urn:ietf:params:scim:api:messages:2.0:Error"
-    YANDEX_USER_EXT = "urn:ietf:params:scim:schemas:extension:yandex360:2.0:User"
-    GROUP = "urn:ietf:params:scim:schemas:core:2.0:Group"
+# SCIM схемы — обычные строковые константы: Enum-значения в default_factory
+# коэрцировались обратно в str при каждой сериализации
+USER_SCHEMA: Final[str] = "urn:ietf:params:scim:schemas:core:2.0:User"
+LIST_RESPONSE_SCHEMA: Final[str] = "urn:ietf:params:scim:api:messages:2.0:ListResponse"
+PATCH_OP_SCHEMA: Final[str] = "urn:ietf:params:scim:api:messages:2.0:PatchOp"
+ERROR_SCHEMA: Final[str] = "urn:ietf:params:scim:api:messages:2.0:Error"
+YANDEX_USER_EXT_SCHEMA: Final[str] = "urn:ietf:params:scim:schemas:extension:yandex360:2.0:User"
+GROUP_SCHEMA: Final[str] = "urn:ietf:params:scim:schemas:core:2.0:Group"
 
 
 class Email(BaseModel):
@@ -67,7 +66,7 @@ class User(BaseModel):
     title: Optional[str] = None
     isInternalRobot: Optional[bool] = False
     meta: Optional[Meta] = None
-    schemas: List[str] = Field(default_factory=lambda: [SCIMSchema.USER])
+    schemas: List[str] = Field(default_factory=lambda: [USER_SCHEMA])
     
     # Yandex 360 extension
     yandex_extension: Optional[YandexUserExtension] = Field(
@@ -75,23 +74,23 @@ class User(BaseModel):
         alias="urn:ietf:params:scim:schemas:extension:yandex360:2.0:User"
     )
     
-    class Config:
-        populate_by_name = True
-        extra = "allow"  # Разрешаем дополнительные поля
+    model_config = ConfigDict(populate_by_name=True, extra="allow")  # Разрешаем дополнительные поля
 
 
 class ListResponse(BaseModel):
     """Ответ со списком ресурсов SCIM"""
-    schemas: List[str] = Field(default_factory=lambda: [SCIMSchema.LIST_RESPONSE])
+    schemas: List[str] = Field(default_factory=lambda: [LIST_RESPONSE_SCHEMA])
     totalResults: int
     startIndex: int = 1
     itemsPerPage: int
-    Resources: List[Union[User, Dict[str, Any]]] = Field(default_factory=list)
+    # Плоские словари: upstream уже отдает валидный SCIM, а валидация Union
+    # (User, потом Dict) прогоняла полную проверку User для каждой записи
+    Resources: List[Dict[str, Any]] = Field(default_factory=list)
 
 
 class SCIMError(BaseModel):
     """Ошибка SCIM"""
-    schemas: List[str] = Field(default_factory=lambda: [SCIMSchema.ERROR])
+    schemas: List[str] = Field(default_factory=lambda: [ERROR_SCHEMA])
     status: int
     scimType: Optional[str] = None
     detail: Optional[str] = None
@@ -106,7 +105,7 @@ class PatchOperation(BaseModel):
 
 class PatchRequest(BaseModel):
     """PATCH запрос SCIM"""
-    schemas: List[str] = Field(default_factory=lambda: [SCIMSchema.PATCH_OP])
+    schemas: List[str] = Field(default_factory=lambda: [PATCH_OP_SCHEMA])
     Operations: List[PatchOperation]
 
 
@@ -125,17 +124,16 @@ class Group(BaseModel):
     displayName: str
     members: List[GroupMember] = Field(default_factory=list)
     meta: Optional[Meta] = None
-    schemas: List[str] = Field(default_factory=lambda: [SCIMSchema.GROUP])
+    schemas: List[str] = Field(default_factory=lambda: [GROUP_SCHEMA])
     
-    class Config:
-        populate_by_name = True
-        extra = "allow"  # Разрешаем дополнительные поля
+    model_config = ConfigDict(populate_by_name=True, extra="allow")  # Разрешаем дополнительные поля
 
 
 class GroupListResponse(BaseModel):
     """Ответ со списком групп SCIM"""
-    schemas: List[str] = Field(default_factory=lambda: [SCIMSchema.LIST_RESPONSE])
+    schemas: List[str] = Field(default_factory=lambda: [LIST_RESPONSE_SCHEMA])
     totalResults: int
     startIndex: int = 1
     itemsPerPage: int
-    Resources: List[Union[Group, Dict[str, Any]]] = Field(default_factory=list)
\ No newline at end of file
+    # Плоские словари — по той же причине, что и в ListResponse
+    Resources: List[Dict[str, Any]] = Field(default_factory=list)
\ No newline at end of file
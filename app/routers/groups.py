@@ -1,91 +1,100 @@
 """Groups роутер для SCIM API"""
 
 from fastapi import APIRouter, Query, HTTPException, Request, Depends
+from fastapi.responses import ORJSONResponse
 from typing import Optional, List, Dict, Any, Union
 import logging
 
+from ..config import FILTER_FETCH_MULTIPLIER, MAX_FILTER_FETCH_SIZE
 from ..models.scim import Group, GroupListResponse, PatchRequest, SCIMError
 from ..services.proxy import proxy_service
-from ..services.filter_parser import FilterParser
-from ..services.filter_engine import FilterEngine
+from ..services.filter_parser import parse_filter
+from ..services.filter_engine import filter_engine
 from ..utils.exceptions import (
     InvalidFilterError, 
     FilterEvaluationError, 
     UpstreamError,
     ResourceNotFoundError
 )
+import re
 
-router = APIRouter(prefix="/Groups", tags=["groups"])
-logger = logging.getLogger(__name__)
+# Путь операции вида members[value eq "user123"].display разбирается одним
+# проходом скомпилированного регулярного выражения вместо цепочки str.split
+_PATCH_PATH_RE = re.compile(r'^([^\[]+)\[\s*(\w+)\s+eq\s+(.+?)\s*\](?:\.(.+))?$')
 
-# Инициализируем сервисы
-filter_parser = FilterParser()
-filter_engine = FilterEngine()
+# Известная опечатка в схеме PatchOp (лишний пробел перед версией)
+_PATCH_OP_SCHEMA_TYPO = "urn:ietf:params:scim:api:messages: 2.0:PatchOp"
+_PATCH_OP_SCHEMA_FIXED = "urn:ietf:params:scim:api:messages:2.0:PatchOp"
 
+# Таблицы для горячего цикла адаптации операций: поиск в dict вместо
+# .lower() и сравнений строк на каждую операцию
+_OP_LOWER = {
+    'add': 'add', 'Add': 'add',
+    'remove': 'remove', 'Remove': 'remove',
+    'replace': 'replace', 'Replace': 'replace',
+}
+_BOOL_MAP = {
+    'true': True, 'True': True, 'TRUE': True,
+    'false': False, 'False': False, 'FALSE': False,
+}
 
-def get_request_headers(request: Request) -> Dict[str, str]:
-    """Извлекает заголовки из запроса"""
-    return dict(request.headers)
+# Обязательные атрибуты SCIM: всегда включаем и никогда не исключаем
+_SCIM_REQUIRED_ATTRS = frozenset({'id', 'schemas'})
 
+router = APIRouter(prefix="/Groups", tags=["groups"], default_response_class=ORJSONResponse)
+logger = logging.getLogger(__name__)
 
-def _filter_group_attributes(group: Union[Group, Dict[str, Any]], attributes: Optional[List[str]] = None, excluded_attributes: Optional[List[str]] = None) -> Union[Group, Dict[str, Any]]:
-    """Фильтрует атрибуты группы согласно SCIM спецификации"""
-    
-    # Если фильтрация не нужна, возвращаем как есть
-    if not attributes and not excluded_attributes:
-        return group
-    
-    # Преобразуем группу в словарь
-    if isinstance(group, dict):
-        group_dict = group.copy()
-    elif hasattr(group, 'dict') and callable(getattr(group, 'dict')):
-        group_dict = group.dict(by_alias=True, exclude_none=False)
-    else:
-        group_dict = group.__dict__.copy()
-    
-    # Если указаны конкретные атрибуты для включения
-    if attributes:
-        # Всегда включаем обязательные атрибуты SCIM
-        required_attributes = {'id', 'schemas'}
-        attributes_set = set(attributes) | required_attributes
-        
-        # Фильтруем только указанные атрибуты
-        filtered_dict = {}
-        for attr in attributes_set:
-            if attr in group_dict:
-                filtered_dict[attr] = group_dict[attr]
-        
-        return filtered_dict
-    
-    # Если указаны атрибуты для исключения
-    if excluded_attributes:
-        # Никогда не исключаем обязательные атрибуты SCIM
-        required_attributes = {'id', 'schemas'}
-        excluded_set = set(excluded_attributes) - required_attributes
-        
-        # Исключаем указанные атрибуты
-        filtered_dict = group_dict.copy()
-        for attr in excluded_set:
-            filtered_dict.pop(attr, None)
-        
-        return filtered_dict
-    
-    # Если фильтрация не указана, возвращаем все атрибуты
-    return group_dict
+
+# Заголовки, которые реально уходят в upstream (см. _prepare_headers в proxy):
+# копируем из ASGI scope только их, а не все заголовки запроса
+_FORWARDED_HEADERS = frozenset({
+    'authorization',
+    'x-api-key',
+    'x-auth-token',
+    'bearer',
+    'cookie',
+    'x-forwarded-for',
+    'x-real-ip',
+    'user-agent',
+})
+
+
+def get_request_headers(request: Request) -> Dict[str, str]:
+    """Извлекает проксируемые заголовки из запроса"""
+    return {k: v for k, v in request.headers.items() if k in _FORWARDED_HEADERS}
 
 
 def _apply_group_attribute_filtering(groups: List[Union[Group, Dict[str, Any]]], attributes: Optional[List[str]] = None, excluded_attributes: Optional[List[str]] = None) -> List[Union[Group, Dict[str, Any]]]:
-    """Применяет фильтрацию атрибутов к списку групп"""
+    """Применяет фильтрацию атрибутов к списку групп согласно SCIM спецификации"""
     if not attributes and not excluded_attributes:
         # Если фильтрация не нужна, возвращаем как есть
         return groups
-    
-    filtered_groups = []
-    for group in groups:
-        filtered_group = _filter_group_attributes(group, attributes, excluded_attributes)
-        filtered_groups.append(filtered_group)
-    
-    return filtered_groups
+
+    # Для pydantic-моделей проекция передается прямо в model_dump: сериализатор
+    # pydantic-core не материализует незапрошенные поля (например, большой members)
+    if attributes:
+        keep = frozenset(attributes) | _SCIM_REQUIRED_ATTRS
+        return [
+            {k: v for k, v in group.items() if k in keep}
+            if isinstance(group, dict)
+            else group.model_dump(by_alias=True, include=keep)
+            for group in groups
+        ]
+
+    drop = frozenset(excluded_attributes) - _SCIM_REQUIRED_ATTRS
+    if all(isinstance(group, dict) for group in groups):
+        # Частый случай: upstream уже вернул плоские словари — чистим их
+        # на месте и переиспользуем список, не создавая новых словарей
+        for group in groups:
+            for key in drop:
+                group.pop(key, None)
+        return groups
+    return [
+        {k: v for k, v in group.items() if k not in drop}
+        if isinstance(group, dict)
+        else group.model_dump(by_alias=True, exclude_none=False, exclude=drop)
+        for group in groups
+    ]
 
 
 @router.get("", response_model=GroupListResponse)
@@ -102,59 +111,66 @@ async def list_groups(
     """Получение списка групп с поддержкой фильтрации"""
     
     try:
-        logger.info(f"Processing groups request with filter: {filter}")
+        # Ленивое %-форматирование: строка собирается только если INFO включен
+        logger.info("Processing groups request with filter: %s", filter)
         headers = get_request_headers(request)
-        logger.info(f"Headers extracted: {len(headers)} headers")
-        
+
         # Парсим атрибуты если указаны
         attributes_list = attributes.split(",") if attributes else None
         excluded_attributes_list = excluded_attributes.split(",") if excluded_attributes else None
-        logger.info(f"Attributes parsed - attributes: {attributes_list}, excluded: {excluded_attributes_list}")
         
         # Если есть фильтр, используем специальную логику для загрузки всех данных
         if filter:
             try:
-                logger.info(f"Parsing filter: {filter}")
-                # Парсим фильтр
-                filter_expr = filter_parser.parse(filter)
-                logger.info(f"Filter parsed successfully: {filter_expr}")
-                
+                # Парсим фильтр (результат кэшируется по строке фильтра)
+                filter_expr = parse_filter(filter)
+
                 # Загружаем больше данных для фильтрации
-                from ..config import settings
-                max_fetch = min(count * settings.filter_fetch_multiplier, settings.max_filter_fetch_size)
-                logger.info(f"Loading up to {max_fetch} groups for filtering")
+                max_fetch = min(count * FILTER_FETCH_MULTIPLIER, MAX_FILTER_FETCH_SIZE)
+                logger.info("Loading up to %d groups for filtering", max_fetch)
                 
-                all_groups = await proxy_service.get_all_groups_for_filtering(
+                # Страницы обрабатываются по мере получения: фильтр и окно
+                # пагинации применяются на лету, полный набор групп в память
+                # не собирается, а ранний выход останавливает запросы
+                start_idx = start_index - 1  # Преобразуем в 0-based индекс
+                end_idx = start_idx + count
+                paginated_groups: List[Any] = []
+                total_matches = 0
+                scanned = 0
+                async for page in proxy_service.iter_groups_for_filtering(
                     headers=headers,
                     max_results=max_fetch,
                     attributes=attributes_list,
                     excluded_attributes=excluded_attributes_list
-                )
-                logger.info(f"Loaded {len(all_groups)} groups for filtering")
-                
-                # Применяем фильтр ко всем загруженным данным
-                logger.info(f"Applying filter to {len(all_groups)} groups")
-                filtered_groups = filter_engine.apply_filter(all_groups, filter_expr)
-                logger.info(f"Filter applied, {len(filtered_groups)} groups match")
-                
-                # Применяем пагинацию к отфильтрованным результатам
-                start_idx = start_index - 1  # Преобразуем в 0-based индекс
-                end_idx = start_idx + count
-                paginated_groups = filtered_groups[start_idx:end_idx]
-                
+                ):
+                    scanned += len(page)
+                    for group in filter_engine.iter_filter(page, filter_expr):
+                        if start_idx <= total_matches < end_idx:
+                            paginated_groups.append(group)
+                        total_matches += 1
+                    if total_matches >= end_idx:
+                        break
+                logger.info("Filter applied to %d groups, %d match", scanned, total_matches)
+
                 # Применяем фильтрацию атрибутов к отфильтрованным результатам
-                filtered_paginated_groups = _apply_group_attribute_filtering(list(paginated_groups), attributes_list, excluded_attributes_list)
-                
+                # (без проекции страница используется как есть, без вызова)
+                if attributes_list or excluded_attributes_list:
+                    filtered_paginated_groups = _apply_group_attribute_filtering(paginated_groups, attributes_list, excluded_attributes_list)
+                else:
+                    filtered_paginated_groups = paginated_groups
+
                 # Создаем ответ
                 response = GroupListResponse(
                     schemas=["urn:ietf:params:scim:api:messages:2.0:ListResponse"],
-                    totalResults=len(filtered_groups),
+                    totalResults=total_matches,
                     startIndex=start_index,
                     itemsPerPage=len(filtered_paginated_groups),
                     Resources=filtered_paginated_groups
                 )
-                
-                logger.info(f"Returning {len(paginated_groups)} groups (page {start_index}-{start_index + len(paginated_groups) - 1} of {len(filtered_groups)} total)")
+
+                logger.info("Returning %d groups (page %d-%d of %d total)",
+                            len(paginated_groups), start_index,
+                            start_index + len(paginated_groups) - 1, total_matches)
                 
             except InvalidFilterError as e:
                 logger.error(f"Invalid filter error: {e}", exc_info=True)
@@ -168,7 +184,7 @@ async def list_groups(
         
         else:
             # Без фильтра используем обычную пагинацию
-            logger.info(f"No filter, using standard pagination with start_index={start_index}, count={count}")
+            logger.info("No filter, using standard pagination with start_index=%d, count=%d", start_index, count)
             response = await proxy_service.get_groups(
                 headers=headers,
                 start_index=start_index,
@@ -176,11 +192,10 @@ async def list_groups(
                 attributes=None,  # НЕ передаем в upstream API
                 excluded_attributes=None  # НЕ передаем в upstream API
             )
-            logger.info(f"Upstream API returned {len(response.Resources)} groups")
-            
+            logger.info("Upstream API returned %d groups", len(response.Resources))
+
             # Применяем фильтрацию атрибутов на уровне прокси
             if attributes_list or excluded_attributes_list:
-                logger.info(f"Applying attribute filtering: attributes={attributes_list}, excluded={excluded_attributes_list}")
                 filtered_resources = _apply_group_attribute_filtering(response.Resources, attributes_list, excluded_attributes_list)
                 
                 # Создаем новый ответ с отфильтрованными атрибутами
@@ -191,7 +206,7 @@ async def list_groups(
                     itemsPerPage=response.itemsPerPage,
                     Resources=filtered_resources
                 )
-                logger.info(f"Attribute filtering applied to {len(filtered_resources)} groups")
+                logger.info("Attribute filtering applied to %d groups", len(filtered_resources))
         
         return response
         
@@ -275,28 +290,29 @@ async def _adapt_patch_for_upstream(
     
     # Сначала собираем операции add с фильтрацией, которые нужно преобразовать
     for op in patch_request.Operations:
-        if op.op.lower() == "add" and op.path and "[" in op.path and "]" in op.path:
+        # Приводим операцию к нижнему регистру для upstream API
+        op_name = _OP_LOWER.get(op.op) or op.op.lower()
+        if op_name == "add" and op.path and "[" in op.path and "]" in op.path:
             add_operations_to_convert.append(op)
         else:
             # Обычные операции добавляем как есть
-            adapted_op: Dict[str, Any] = {
-                "op": op.op.lower()  # Приводим операцию к нижнему регистру для upstream API
-            }
-            
+            adapted_op: Dict[str, Any] = {"op": op_name}
+
             # Добавляем path если указан
             if op.path is not None:
                 adapted_op["path"] = op.path
-            
+
             # Добавляем value если указано, с правильной типизацией
             if op.value is not None:
                 # Специальная обработка для булевых значений
-                if isinstance(op.value, bool):
-                    adapted_op["value"] = op.value
-                elif isinstance(op.value, str) and op.value.lower() in ['true', 'false']:
-                    adapted_op["value"] = op.value.lower() == 'true'
+                if isinstance(op.value, str):
+                    coerced = _BOOL_MAP.get(op.value)
+                    if coerced is None and 4 <= len(op.value) <= 5:
+                        coerced = _BOOL_MAP.get(op.value.lower())
+                    adapted_op["value"] = op.value if coerced is None else coerced
                 else:
                     adapted_op["value"] = op.value
-            
+
             adapted_operations.append(adapted_op)
     
     # Если есть операции add с фильтрацией, преобразуем их
@@ -304,15 +320,22 @@ async def _adapt_patch_for_upstream(
         logger.info(f"Converting {len(add_operations_to_convert)} add operations with filtering to replace operations")
         
         try:
-            # Получаем текущие данные группы
+            # Получаем текущие данные группы; model_dump выполняется
+            # Rust-сериализатором pydantic-core, в отличие от устаревшего .dict()
             current_group = await proxy_service.get_group(group_id, headers)
-            current_group_dict = current_group.dict() if hasattr(current_group, 'dict') else current_group.__dict__
+            if isinstance(current_group, dict):
+                current_group_dict = current_group
+            elif hasattr(current_group, 'model_dump'):
+                current_group_dict = current_group.model_dump()
+            else:
+                current_group_dict = current_group.__dict__
             
             # Группируем операции по базовому пути (например, members)
             operations_by_path = {}
             for op in add_operations_to_convert:
-                # Извлекаем базовый путь (например, "members" из "members[value eq \"user123\"].display")
-                base_path = op.path.split('[')[0]
+                # Извлекаем базовый путь (например, "members" из "members[value eq \"user123\"].display");
+                # partition не создает промежуточный список в отличие от split
+                base_path = op.path.partition('[')[0]
                 if base_path not in operations_by_path:
                     operations_by_path[base_path] = []
                 operations_by_path[base_path].append(op)
@@ -326,51 +349,60 @@ async def _adapt_patch_for_upstream(
                 if not isinstance(current_array, list):
                     current_array = []
                 
-                # Применяем операции add
-                updated_array = current_array.copy()
-                
+                # Применяем операции add. Существующие элементы обновляются
+                # на месте, новые копятся отдельно — без упреждающей копии
+                # всего массива (на группе в 10k участников это заметно)
+                new_items: List[Dict[str, Any]] = []
+
+                # Индекс {поле: {значение: элемент}} для O(1) поиска вместо
+                # линейного скана массива на каждую операцию
+                index: Dict[str, Dict[Any, Any]] = {}
+                for item in current_array:
+                    if isinstance(item, dict):
+                        for key, value in item.items():
+                            if isinstance(value, (str, int, float, bool)):
+                                index.setdefault(key, {})[value] = item
+
                 for op in ops:
-                    # Парсим фильтр из path (например, "value eq \"user123\"")
-                    if '[' in op.path and ']' in op.path:
-                        filter_part = op.path.split('[')[1].split(']')[0]
-                        field_part = op.path.split('].')[1] if '].' in op.path else None
-                        
-                        # Простой парсинг фильтра "value eq \"user123\""
-                        if ' eq ' in filter_part:
-                            filter_field, filter_value = filter_part.split(' eq ')
-                            filter_field = filter_field.strip()
-                            filter_value = filter_value.strip().strip('"\'')
-                            
-                            # Ищем существующий элемент с таким фильтром
-                            existing_item = None
-                            for item in updated_array:
-                                if isinstance(item, dict) and item.get(filter_field) == filter_value:
-                                    existing_item = item
-                                    break
-                            
-                            if existing_item:
-                                # Обновляем существующий элемент
-                                if field_part:
-                                    existing_item[field_part] = op.value
-                                else:
-                                    # Если нет field_part, заменяем весь объект
-                                    if isinstance(op.value, dict):
-                                        existing_item.update(op.value)
-                                logger.info(f"Updated existing item with {filter_field}={filter_value}")
+                    # Парсим путь с фильтром (например, members[value eq "user123"].display)
+                    match = _PATCH_PATH_RE.match(op.path)
+                    if match:
+                        filter_field = match.group(2)
+                        filter_value = match.group(3).strip('"\'')
+                        field_part = match.group(4)
+
+                        # Ищем существующий элемент с таким фильтром
+                        existing_item = index.get(filter_field, {}).get(filter_value)
+
+                        if existing_item:
+                            # Обновляем существующий элемент
+                            if field_part:
+                                existing_item[field_part] = op.value
+                            else:
+                                # Если нет field_part, заменяем весь объект
+                                if isinstance(op.value, dict):
+                                    existing_item.update(op.value)
+                            logger.info(f"Updated existing item with {filter_field}={filter_value}")
+                        else:
+                            # Создаем новый элемент
+                            new_item = {filter_field: filter_value}
+                            if field_part:
+                                new_item[field_part] = op.value
+                            elif isinstance(op.value, dict):
+                                new_item.update(op.value)
                             else:
-                                # Создаем новый элемент
-                                new_item = {filter_field: filter_value}
-                                if field_part:
-                                    new_item[field_part] = op.value
-                                elif isinstance(op.value, dict):
-                                    new_item.update(op.value)
-                                else:
-                                    new_item['value'] = op.value
-                                
-                                updated_array.append(new_item)
-                                logger.info(f"Added new item with {filter_field}={filter_value}")
+                                new_item['value'] = op.value
+
+                            new_items.append(new_item)
+                            for key, value in new_item.items():
+                                if isinstance(value, (str, int, float, bool)):
+                                    index.setdefault(key, {})[value] = new_item
+                            logger.info(f"Added new item with {filter_field}={filter_value}")
                 
-                # Создаем операцию replace для всего массива
+                # Создаем операцию replace для всего массива; конкатенация
+                # выполняется один раз, а при отсутствии новых элементов
+                # переиспользуется исходный список
+                updated_array = current_array + new_items if new_items else current_array
                 replace_op = {
                     "op": "replace",
                     "path": base_path,
@@ -384,11 +416,12 @@ async def _adapt_patch_for_upstream(
             # В случае ошибки, пропускаем операции add с предупреждением
             logger.warning("Falling back to skipping add operations with filtering")
     
-    # Исправляем схему если есть опечатка
+    # Исправляем схему если есть опечатка; в типичном запросе ее нет,
+    # поэтому сначала дешевая проверка без пересоздания списка
     schemas = patch_request.schemas
-    if schemas:
-        schemas = [schema.replace("urn:ietf:params:scim:api:messages: 2.0:PatchOp",
-                                "urn:ietf:params:scim:api:messages:2.0:PatchOp") for schema in schemas]
+    if schemas and any(_PATCH_OP_SCHEMA_TYPO in schema for schema in schemas):
+        schemas = [schema.replace(_PATCH_OP_SCHEMA_TYPO, _PATCH_OP_SCHEMA_FIXED)
+                   for schema in schemas]
     
     return {
         "schemas": schemas,
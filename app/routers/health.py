@@ -1,22 +1,29 @@
 """Health check роутер"""
 
-from fastapi import APIRouter
-from typing import Dict, Any
+from fastapi import APIRouter, Response
+
+import orjson
 
 router = APIRouter()
 
 
+# Ответы статичны — сериализуем один раз при импорте
+_HEALTH_BYTES = orjson.dumps({
+    "status": "healthy",
+    "service": "scim-proxy",
+    "version": "1.0.0"
+})
+
+_ROOT_BYTES = orjson.dumps({"message": "SCIM Proxy Service is running"})
+
+
 @router.get("/health")
-async def health_check() -> Dict[str, Any]:
+async def health_check() -> Response:
     """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "service": "scim-proxy",
-        "version": "1.0.0"
-    }
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
 
 @router.get("/")
-async def root() -> Dict[str, str]:
+async def root() -> Response:
     """Root endpoint"""
-    return {"message": "SCIM Proxy Service is running"}
\ No newline at end of file
+    return Response(content=_ROOT_BYTES, media_type="application/json")
@@ -1,92 +1,95 @@
 """ResourceTypes роутер для SCIM API"""
 
-from fastapi import APIRouter
-from typing import Dict, Any, List
+from fastapi import APIRouter, Request, Response
+from typing import Dict, Any
+
+import hashlib
+
+import orjson
 
 router = APIRouter(tags=["resource-types"])
 
 
+# Описания типов ресурсов статичны — сериализуем один раз при импорте
+_USER_RESOURCE_TYPE: Dict[str, Any] = {
+    "schemas": ["urn:ietf:params:scim:schemas:core:2.0:ResourceType"],
+    "id": "User",
+    "name": "User",
+    "endpoint": "/Users",
+    "description": "User Account",
+    "schema": "urn:ietf:params:scim:schemas:core:2.0:User",
+    "schemaExtensions": [
+        {
+            "schema": "urn:ietf:params:scim:schemas:extension:yandex360:2.0:User",
+            "required": False
+        }
+    ],
+    "meta": {
+        "location": "/v2/ResourceTypes/User",
+        "resourceType": "ResourceType"
+    }
+}
+
+_GROUP_RESOURCE_TYPE: Dict[str, Any] = {
+    "schemas": ["urn:ietf:params:scim:schemas:core:2.0:ResourceType"],
+    "id": "Group",
+    "name": "Group",
+    "endpoint": "/Groups",
+    "description": "Group",
+    "schema": "urn:ietf:params:scim:schemas:core:2.0:Group",
+    "meta": {
+        "location": "/v2/ResourceTypes/Group",
+        "resourceType": "ResourceType"
+    }
+}
+
+_RESOURCE_TYPES_LIST: Dict[str, Any] = {
+    "schemas": ["urn:ietf:params:scim:api:messages:2.0:ListResponse"],
+    "totalResults": 2,
+    "startIndex": 1,
+    "itemsPerPage": 2,
+    "Resources": [_USER_RESOURCE_TYPE, _GROUP_RESOURCE_TYPE]
+}
+
+_RESOURCE_TYPES_BYTES = orjson.dumps(_RESOURCE_TYPES_LIST)
+_USER_RESOURCE_TYPE_BYTES = orjson.dumps(_USER_RESOURCE_TYPE)
+_GROUP_RESOURCE_TYPE_BYTES = orjson.dumps(_GROUP_RESOURCE_TYPE)
+
+
+def _etag(body: bytes) -> str:
+    """ETag по содержимому для условных запросов discovery-эндпоинтов"""
+    return '"{}"'.format(hashlib.blake2s(body, digest_size=8).hexdigest())
+
+
+def _cache_headers(body: bytes) -> Dict[str, str]:
+    return {"ETag": _etag(body), "Cache-Control": "public, max-age=3600"}
+
+
+_RESOURCE_TYPES_HEADERS = _cache_headers(_RESOURCE_TYPES_BYTES)
+_USER_RESOURCE_TYPE_HEADERS = _cache_headers(_USER_RESOURCE_TYPE_BYTES)
+_GROUP_RESOURCE_TYPE_HEADERS = _cache_headers(_GROUP_RESOURCE_TYPE_BYTES)
+
+
+def _conditional_response(request: Request, body: bytes, headers: Dict[str, str]) -> Response:
+    """Отдает 304 при совпадении If-None-Match, иначе закэшированные байты"""
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/scim+json", headers=headers)
+
+
 @router.get("/ResourceTypes")
-async def get_resource_types() -> Dict[str, Any]:
+async def get_resource_types(request: Request) -> Response:
     """Возвращает список поддерживаемых типов ресурсов согласно RFC 7644"""
-    
-    return {
-        "schemas": ["urn:ietf:params:scim:api:messages:2.0:ListResponse"],
-        "totalResults": 2,
-        "startIndex": 1,
-        "itemsPerPage": 2,
-        "Resources": [
-            {
-                "schemas": ["urn:ietf:params:scim:schemas:core:2.0:ResourceType"],
-                "id": "User",
-                "name": "User",
-                "endpoint": "/Users",
-                "description": "User Account",
-                "schema": "urn:ietf:params:scim:schemas:core:2.0:User",
-                "schemaExtensions": [
-                    {
-                        "schema": "urn:ietf:params:scim:schemas:extension:yandex360:2.0:User",
-                        "required": False
-                    }
-                ],
-                "meta": {
-                    "location": "/v2/ResourceTypes/User",
-                    "resourceType": "ResourceType"
-                }
-            },
-            {
-                "schemas": ["urn:ietf:params:scim:schemas:core:2.0:ResourceType"],
-                "id": "Group",
-                "name": "Group",
-                "endpoint": "/Groups",
-                "description": "Group",
-                "schema": "urn:ietf:params:scim:schemas:core:2.0:Group",
-                "meta": {
-                    "location": "/v2/ResourceTypes/Group",
-                    "resourceType": "ResourceType"
-                }
-            }
-        ]
-    }
+    return _conditional_response(request, _RESOURCE_TYPES_BYTES, _RESOURCE_TYPES_HEADERS)
 
 
 @router.get("/ResourceTypes/User")
-async def get_user_resource_type() -> Dict[str, Any]:
+async def get_user_resource_type(request: Request) -> Response:
     """Возвращает информацию о типе ресурса User"""
-    
-    return {
-        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:ResourceType"],
-        "id": "User",
-        "name": "User",
-        "endpoint": "/Users",
-        "description": "User Account",
-        "schema": "urn:ietf:params:scim:schemas:core:2.0:User",
-        "schemaExtensions": [
-            {
-                "schema": "urn:ietf:params:scim:schemas:extension:yandex360:2.0:User",
-                "required": False
-            }
-        ],
-        "meta": {
-            "location": "/v2/ResourceTypes/User",
-            "resourceType": "ResourceType"
-        }
-    }
+    return _conditional_response(request, _USER_RESOURCE_TYPE_BYTES, _USER_RESOURCE_TYPE_HEADERS)
 
 
 @router.get("/ResourceTypes/Group")
-async def get_group_resource_type() -> Dict[str, Any]:
+async def get_group_resource_type(request: Request) -> Response:
     """Возвращает информацию о типе ресурса Group"""
-    
-    return {
-        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:ResourceType"],
-        "id": "Group",
-        "name": "Group",
-        "endpoint": "/Groups",
-        "description": "Group",
-        "schema": "urn:ietf:params:scim:schemas:core:2.0:Group",
-        "meta": {
-            "location": "/v2/ResourceTypes/Group",
-            "resourceType": "ResourceType"
-        }
-    }
\ No newline at end of file
+    return _conditional_response(request, _GROUP_RESOURCE_TYPE_BYTES, _GROUP_RESOURCE_TYPE_HEADERS)
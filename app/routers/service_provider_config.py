@@ -1,60 +1,87 @@
 """ServiceProviderConfig роутер для SCIM API"""
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response
 from typing import Dict, Any
 
+import hashlib
+
+import orjson
+
 router = APIRouter(tags=["service-provider-config"])
 
 
-@router.get("/ServiceProviderConfig")
-async def get_service_provider_config() -> Dict[str, Any]:
-    """Возвращает конфигурацию SCIM сервиса согласно RFC 7644"""
-    
-    return {
-        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:ServiceProviderConfig"],
-        "documentationUri": "https://tools.ietf.org/html/rfc7644",
-        "patch": {
-            "supported": True
-        },
-        "bulk": {
-            "supported": False,
-            "maxOperations": 0,
-            "maxPayloadSize": 0
-        },
-        "filter": {
-            "supported": True,
-            "maxResults": 1000
-        },
-        "changePassword": {
-            "supported": False
-        },
-        "sort": {
-            "supported": True
+# Конфигурация статична — словарь и его сериализация выполняются один раз
+# при импорте, обработчик отдает готовые байты
+_SERVICE_PROVIDER_CONFIG: Dict[str, Any] = {
+    "schemas": ["urn:ietf:params:scim:schemas:core:2.0:ServiceProviderConfig"],
+    "documentationUri": "https://tools.ietf.org/html/rfc7644",
+    "patch": {
+        "supported": True
+    },
+    "bulk": {
+        "supported": False,
+        "maxOperations": 0,
+        "maxPayloadSize": 0
+    },
+    "filter": {
+        "supported": True,
+        "maxResults": 1000
+    },
+    "changePassword": {
+        "supported": False
+    },
+    "sort": {
+        "supported": True
+    },
+    "etag": {
+        "supported": False
+    },
+    "authenticationSchemes": [
+        {
+            "type": "httpbasic",
+            "name": "HTTP Basic",
+            "description": "Authentication scheme using the HTTP Basic Standard",
+            "specUri": "https://tools.ietf.org/html/rfc2617",
+            "documentationUri": "https://example.com/help/httpBasic.html"
         },
-        "etag": {
-            "supported": False
-        },
-        "authenticationSchemes": [
-            {
-                "type": "httpbasic",
-                "name": "HTTP Basic",
-                "description": "Authentication scheme using the HTTP Basic Standard",
-                "specUri": "https://tools.ietf.org/html/rfc2617",
-                "documentationUri": "https://example.com/help/httpBasic.html"
-            },
-            {
-                "type": "oauthbearertoken",
-                "name": "OAuth Bearer Token",
-                "description": "Authentication scheme using the OAuth Bearer Token Standard",
-                "specUri": "https://tools.ietf.org/html/rfc6750",
-                "documentationUri": "https://example.com/help/oauth.html"
-            }
-        ],
-        "meta": {
-            "location": "/v2/ServiceProviderConfig",
-            "resourceType": "ServiceProviderConfig",
-            "created": "2024-01-01T00:00:00Z",
-            "lastModified": "2024-01-01T00:00:00Z",
-            "version": "v1"
+        {
+            "type": "oauthbearertoken",
+            "name": "OAuth Bearer Token",
+            "description": "Authentication scheme using the OAuth Bearer Token Standard",
+            "specUri": "https://tools.ietf.org/html/rfc6750",
+            "documentationUri": "https://example.com/help/oauth.html"
         }
-    }
\ No newline at end of file
+    ],
+    "meta": {
+        "location": "/v2/ServiceProviderConfig",
+        "resourceType": "ServiceProviderConfig",
+        "created": "2024-01-01T00:00:00Z",
+        "lastModified": "2024-01-01T00:00:00Z",
+        "version": "v1"
+    }
+}
+
+_SERVICE_PROVIDER_CONFIG_BYTES = orjson.dumps(_SERVICE_PROVIDER_CONFIG)
+
+# ETag по содержимому: SCIM-клиенты опрашивают discovery-эндпоинты на каждой
+# синхронизации, совпадение If-None-Match превращает ответ в пустой 304
+_SERVICE_PROVIDER_CONFIG_ETAG = '"{}"'.format(
+    hashlib.blake2s(_SERVICE_PROVIDER_CONFIG_BYTES, digest_size=8).hexdigest()
+)
+
+_CACHE_HEADERS = {
+    "ETag": _SERVICE_PROVIDER_CONFIG_ETAG,
+    "Cache-Control": "public, max-age=3600"
+}
+
+
+@router.get("/ServiceProviderConfig")
+async def get_service_provider_config(request: Request) -> Response:
+    """Возвращает конфигурацию SCIM сервиса согласно RFC 7644"""
+    if request.headers.get("if-none-match") == _SERVICE_PROVIDER_CONFIG_ETAG:
+        return Response(status_code=304, headers=_CACHE_HEADERS)
+    return Response(
+        content=_SERVICE_PROVIDER_CONFIG_BYTES,
+        media_type="application/scim+json",
+        headers=_CACHE_HEADERS
+    )
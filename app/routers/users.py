@@ -1,94 +1,207 @@
 """Users роутер для SCIM API"""
 
 from fastapi import APIRouter, Query, HTTPException, Request, Depends
-from typing import Optional, List, Dict, Any, Union
+from fastapi.responses import ORJSONResponse
+from typing import Optional, List, Dict, Any, Callable, Iterable, Union
+import asyncio
 import logging
+import operator
+import sys
+import time
+from collections import defaultdict
+from functools import lru_cache, wraps
 
+from ..config import get_settings, FILTER_FETCH_MULTIPLIER, MAX_FILTER_FETCH_SIZE
 from ..models.scim import User, ListResponse, PatchRequest, SCIMError
+from ..models.filters import (
+    AttributeExpression, FilterExpression, GroupExpression,
+    LogicalExpression, FilterOperator, LogicalOperator
+)
 from ..services.proxy import proxy_service
-from ..services.filter_parser import FilterParser
-from ..services.filter_engine import FilterEngine
+from ..services.filter_parser import parse_filter
+from ..services.filter_engine import filter_engine
 from ..utils.exceptions import (
     InvalidFilterError, 
     FilterEvaluationError, 
     UpstreamError,
     ResourceNotFoundError
 )
+import re
+
+# Путь операции вида phoneNumbers[type eq "work"].value разбирается одним
+# проходом скомпилированного регулярного выражения вместо цепочки str.split
+_PATCH_PATH_RE = re.compile(r'^([^\[]+)\[\s*(\w+)\s+eq\s+(.+?)\s*\](?:\.(.+))?$')
 
-router = APIRouter(prefix="/Users", tags=["users"])
+router = APIRouter(prefix="/Users", tags=["users"], default_response_class=ORJSONResponse)
 logger = logging.getLogger(__name__)
 
-# Инициализируем сервисы
-filter_parser = FilterParser()
-filter_engine = FilterEngine()
+
+# Заголовки, которые реально уходят в upstream (см. _prepare_headers в proxy):
+# копируем из ASGI scope только их, а не все заголовки запроса
+_FORWARDED_HEADERS = frozenset({
+    'authorization',
+    'x-api-key',
+    'x-auth-token',
+    'bearer',
+    'cookie',
+    'x-forwarded-for',
+    'x-real-ip',
+    'user-agent',
+})
 
 
 def get_request_headers(request: Request) -> Dict[str, str]:
-    """Извлекает заголовки из запроса"""
-    return dict(request.headers)
+    """Извлекает проксируемые заголовки из запроса"""
+    return {k: v for k, v in request.headers.items() if k in _FORWARDED_HEADERS}
 
 
-def _filter_user_attributes(user: Union[User, Dict[str, Any]], attributes: Optional[List[str]] = None, excluded_attributes: Optional[List[str]] = None) -> Union[User, Dict[str, Any]]:
-    """Фильтрует атрибуты пользователя согласно SCIM спецификации"""
-    
-    # Если фильтрация не нужна, возвращаем как есть
-    if not attributes and not excluded_attributes:
-        return user
-    
-    # Преобразуем пользователя в словарь
-    if isinstance(user, dict):
-        user_dict = user.copy()
-    elif hasattr(user, 'dict') and callable(getattr(user, 'dict')):
-        user_dict = user.dict(by_alias=True, exclude_none=False)
-    else:
-        user_dict = user.__dict__.copy()
-    
-    # Если указаны конкретные атрибуты для включения
+def _scim_endpoint(fn):
+    """Общая обработка ошибок для маршрутов пользователей.
+
+    Каждый обработчик повторял один и тот же try/except; декоратор
+    оставляет единственную точку трансляции ошибок: UpstreamError
+    превращается в HTTPException с кодом upstream, HTTPException проходит
+    как есть, остальное логируется и отдается как 500. Заодно уменьшает
+    байткод обработчиков и число кадров при раскрутке исключения.
+    """
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await fn(*args, **kwargs)
+        except HTTPException:
+            raise
+        except UpstreamError as e:
+            logger.error("Upstream error in %s: %s", fn.__name__, e)
+            raise HTTPException(status_code=e.status_code, detail=e.message)
+        except Exception as e:
+            logger.error("Unexpected error in %s: %s", fn.__name__, e, exc_info=True)
+            raise HTTPException(status_code=500, detail="Internal server error")
+    return wrapper
+
+
+# Фильтры, которые можно делегировать upstream API: точные совпадения по
+# идентифицирующим атрибутам и подстрочный поиск по userName/email
+_PUSHDOWN_EQ_ATTRS = frozenset({'id', 'userName', 'externalId'})
+_PUSHDOWN_MATCH_ATTRS = frozenset({'userName', 'emails.value'})
+
+
+def _can_push_down(expr: FilterExpression) -> bool:
+    """Проверяет, можно ли передать фильтр upstream API как есть.
+
+    Разрешены eq по id/userName/externalId, sw/co по userName/emails.value
+    и их конъюнкции — для таких запросов upstream возвращает одну страницу
+    вместо выборки max_filter_fetch_size записей для локальной фильтрации.
+    """
+    if isinstance(expr, AttributeExpression):
+        if expr.operator == FilterOperator.EQ:
+            return expr.attribute in _PUSHDOWN_EQ_ATTRS
+        if expr.operator in (FilterOperator.SW, FilterOperator.CO):
+            return expr.attribute in _PUSHDOWN_MATCH_ATTRS
+        return False
+
+    if isinstance(expr, LogicalExpression) and expr.operator == LogicalOperator.AND:
+        return (expr.left is not None and expr.right is not None
+                and _can_push_down(expr.left) and _can_push_down(expr.right))
+
+    if isinstance(expr, GroupExpression):
+        return _can_push_down(expr.expression)
+
+    return False
+
+
+# Обязательные атрибуты SCIM: всегда включаем и никогда не исключаем
+_SCIM_REQUIRED_ATTRS = frozenset({'id', 'schemas'})
+
+
+@lru_cache(maxsize=256)
+def _split_attrs(raw: str) -> frozenset:
+    """Разбирает параметр attributes/excludedAttributes в frozenset имен.
+
+    Клиенты шлют один и тот же список атрибутов в каждом запросе, поэтому
+    результат кэшируется по сырой строке, а имена интернируются: проверки
+    `in keep` дальше идут по сравнению указателей.
+    """
+    return frozenset(sys.intern(a.strip()) for a in raw.split(","))
+
+
+# Все атрибуты модели User (по alias). Нужны для распознавания проекции-ноопа:
+# клиенты вроде Microsoft Entra перечисляют в attributes полный набор полей
+_ALL_USER_ATTRS = frozenset(f.alias or name for name, f in User.model_fields.items())
+
+
+def _make_user_projector(attributes: Optional[Iterable[str]] = None, excluded_attributes: Optional[Iterable[str]] = None) -> Optional[Callable[[Union[User, Dict[str, Any]]], Union[User, Dict[str, Any]]]]:
+    """Строит функцию проекции атрибутов для одного пользователя.
+
+    Возвращает None, если проекция — нооп (нет параметров, запрошены все
+    атрибуты или исключаются только обязательные). Наборы ключей
+    вычисляются один раз на запрос, а не на каждого пользователя; для
+    pydantic-моделей проекция передается прямо в model_dump: сериализатор
+    pydantic-core не материализует незапрошенные поля.
+    """
     if attributes:
-        # Всегда включаем обязательные атрибуты SCIM
-        required_attributes = {'id', 'schemas'}
-        attributes_set = set(attributes) | required_attributes
-        
-        # Фильтруем только указанные атрибуты
-        filtered_dict = {}
-        for attr in attributes_set:
-            if attr in user_dict:
-                filtered_dict[attr] = user_dict[attr]
-        
-        return filtered_dict
-    
-    # Если указаны атрибуты для исключения
+        # frozenset(frozenset) не копирует — из роутера приходит кэшированный набор
+        keep = frozenset(attributes) | _SCIM_REQUIRED_ATTRS
+        if keep >= _ALL_USER_ATTRS:
+            # Запрошены все известные атрибуты — проекция ничего не отрежет
+            return None
+
+        def project(user):
+            if isinstance(user, dict):
+                return {k: v for k, v in user.items() if k in keep}
+            return user.model_dump(by_alias=True, include=keep)
+
+        return project
+
     if excluded_attributes:
-        # Никогда не исключаем обязательные атрибуты SCIM
-        required_attributes = {'id', 'schemas'}
-        excluded_set = set(excluded_attributes) - required_attributes
-        
-        # Исключаем указанные атрибуты
-        filtered_dict = user_dict.copy()
-        for attr in excluded_set:
-            filtered_dict.pop(attr, None)
-        
-        return filtered_dict
-    
-    # Если фильтрация не указана, возвращаем все атрибуты
-    return user_dict
+        drop = frozenset(excluded_attributes) - _SCIM_REQUIRED_ATTRS
+        if not drop:
+            # Исключались только обязательные атрибуты — удалять нечего
+            return None
+
+        def project(user):
+            if isinstance(user, dict):
+                # Частый случай: upstream уже вернул плоский словарь —
+                # чистим его на месте, не создавая нового
+                for key in drop:
+                    user.pop(key, None)
+                return user
+            return user.model_dump(by_alias=True, exclude_none=False, exclude=drop)
+
+        return project
 
+    return None
+
+
+def _sort_users(users: List[Union[User, Dict[str, Any]]], sort_by: str, sort_order: Optional[str]) -> None:
+    """Сортирует список пользователей по атрибуту на месте"""
+    reverse = sort_order == 'descending'
+    try:
+        # itemgetter извлекает ключ на уровне C — быстрее лямбды
+        users.sort(key=operator.itemgetter(sort_by), reverse=reverse)
+    except (KeyError, TypeError):
+        # Отсутствующие поля или pydantic-модели — медленный путь с None в конце
+        def sort_key(user):
+            value = user.get(sort_by) if isinstance(user, dict) else getattr(user, sort_by, None)
+            return (value is None, value)
+
+        try:
+            users.sort(key=sort_key, reverse=reverse)
+        except TypeError:
+            # Несравнимые типы значений — оставляем порядок upstream
+            logger.warning("Cannot sort users by %s: mixed value types", sort_by)
 
-def _apply_attribute_filtering(users: List[Union[User, Dict[str, Any]]], attributes: Optional[List[str]] = None, excluded_attributes: Optional[List[str]] = None) -> List[Union[User, Dict[str, Any]]]:
-    """Применяет фильтрацию атрибутов к списку пользователей"""
-    if not attributes and not excluded_attributes:
+
+def _apply_attribute_filtering(users: List[Union[User, Dict[str, Any]]], attributes: Optional[Iterable[str]] = None, excluded_attributes: Optional[Iterable[str]] = None) -> List[Union[User, Dict[str, Any]]]:
+    """Применяет фильтрацию атрибутов к списку пользователей согласно SCIM спецификации"""
+    project = _make_user_projector(attributes, excluded_attributes)
+    if project is None:
         # Если фильтрация не нужна, возвращаем как есть
         return users
-    
-    filtered_users = []
-    for user in users:
-        filtered_user = _filter_user_attributes(user, attributes, excluded_attributes)
-        filtered_users.append(filtered_user)
-    
-    return filtered_users
+    return [project(user) for user in users]
 
 
 @router.get("", response_model=ListResponse)
+@_scim_endpoint
 async def list_users(
     request: Request,
     filter: Optional[str] = Query(None, description="SCIM filter expression"),
@@ -101,180 +214,343 @@ async def list_users(
 ) -> ListResponse:
     """Получение списка пользователей с поддержкой фильтрации"""
     
-    try:
-        logger.info(f"Processing request with filter: {filter}")
-        headers = get_request_headers(request)
-        logger.info(f"Headers extracted: {len(headers)} headers")
-        
-        # Парсим атрибуты если указаны
-        attributes_list = attributes.split(",") if attributes else None
-        excluded_attributes_list = excluded_attributes.split(",") if excluded_attributes else None
-        logger.info(f"Attributes parsed - attributes: {attributes_list}, excluded: {excluded_attributes_list}")
-        
-        # Если есть фильтр, используем специальную логику для загрузки всех данных
-        if filter:
-            try:
-                logger.info(f"Parsing filter: {filter}")
-                # Парсим фильтр
-                filter_expr = filter_parser.parse(filter)
-                logger.info(f"Filter parsed successfully: {filter_expr}")
-                
-                # Загружаем больше данных для фильтрации
-                from ..config import settings
-                max_fetch = min(count * settings.filter_fetch_multiplier, settings.max_filter_fetch_size)
-                logger.info(f"Loading up to {max_fetch} users for filtering")
-                
-                all_users = await proxy_service.get_all_users_for_filtering(
+    logger.info("Processing request with filter: %s", filter)
+    headers = get_request_headers(request)
+
+    # Парсим атрибуты если указаны (frozenset кэшируется по сырой строке)
+    attributes_list = _split_attrs(attributes) if attributes else None
+    excluded_attributes_list = _split_attrs(excluded_attributes) if excluded_attributes else None
+
+    # Если есть фильтр, используем специальную логику для загрузки всех данных
+    if filter:
+        try:
+            # Парсим фильтр (результат кэшируется по строке фильтра:
+            # IdP-поллеры шлют один и тот же фильтр тысячами запросов)
+            filter_expr = parse_filter(filter)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Filter parse cache: %s", parse_filter.cache_info())
+
+            # Простые фильтры делегируем upstream API: одна страница
+            # нужного размера вместо выборки до max_filter_fetch_size
+            # записей с локальной фильтрацией
+            response = None
+            if _can_push_down(filter_expr):
+                try:
+                    upstream_response = await proxy_service.get_users(
+                        headers=headers,
+                        start_index=start_index,
+                        count=count,
+                        filter=filter
+                    )
+                    # Перепроверяем страницу локально: если upstream
+                    # проигнорировал filter, вернутся и не совпавшие записи
+                    verified = filter_engine.apply_filter(upstream_response.Resources, filter_expr)
+                    if len(verified) == len(upstream_response.Resources):
+                        resources = _apply_attribute_filtering(verified, attributes_list, excluded_attributes_list)
+                        response = ListResponse(
+                            schemas=upstream_response.schemas,
+                            totalResults=upstream_response.totalResults,
+                            startIndex=start_index,
+                            itemsPerPage=len(resources),
+                            Resources=resources
+                        )
+                        logger.info("Filter pushed down to upstream, %d users returned", len(resources))
+                    else:
+                        logger.info("Upstream ignored pushed-down filter, falling back to local filtering")
+                except UpstreamError as e:
+                    logger.info("Filter pushdown failed (%s), falling back to local filtering", e)
+
+            if response is not None:
+                return response
+
+            # Потоковая фильтрация: страницы upstream обрабатываются по
+            # мере поступления, и выборка останавливается как только
+            # набрана запрошенная страница совпадений. Для селективных
+            # фильтров это избавляет от загрузки лишних страниц
+            max_fetch = min(count * FILTER_FETCH_MULTIPLIER, MAX_FILTER_FETCH_SIZE)
+            logger.info("Loading up to %d users for filtering", max_fetch)
+
+            start_idx = start_index - 1  # Преобразуем в 0-based индекс
+            end_idx = start_idx + count
+            project = _make_user_projector(attributes_list, excluded_attributes_list)
+            page_users: List[Union[User, Dict[str, Any]]] = []
+            matched = 0
+            scanned = 0
+            if sort_by:
+                # Сортировка требует полного набора совпадений: ранний выход
+                # и окно неприменимы, собираем все в пределах max_fetch
+                matches: List[Union[User, Dict[str, Any]]] = []
+                async for page in proxy_service.iter_users_for_filtering(
                     headers=headers,
                     max_results=max_fetch,
                     attributes=attributes_list,
                     excluded_attributes=excluded_attributes_list
-                )
-                logger.info(f"Loaded {len(all_users)} users for filtering")
-                
-                # Применяем фильтр ко всем загруженным данным
-                logger.info(f"Applying filter to {len(all_users)} users")
-                filtered_users = filter_engine.apply_filter(all_users, filter_expr)
-                logger.info(f"Filter applied, {len(filtered_users)} users match")
-                
-                # Применяем пагинацию к отфильтрованным результатам
-                start_idx = start_index - 1  # Преобразуем в 0-based индекс
-                end_idx = start_idx + count
-                paginated_users = filtered_users[start_idx:end_idx]
-                
-                # Применяем фильтрацию атрибутов к отфильтрованным результатам
-                filtered_paginated_users = _apply_attribute_filtering(list(paginated_users), attributes_list, excluded_attributes_list)
-                
-                # Создаем ответ
-                response = ListResponse(
-                    schemas=["urn:ietf:params:scim:api:messages:2.0:ListResponse"],
-                    totalResults=len(filtered_users),
-                    startIndex=start_index,
-                    itemsPerPage=len(filtered_paginated_users),
-                    Resources=filtered_paginated_users
-                )
-                
-                logger.info(f"Returning {len(paginated_users)} users (page {start_index}-{start_index + len(paginated_users) - 1} of {len(filtered_users)} total)")
-                
-            except InvalidFilterError as e:
-                logger.error(f"Invalid filter error: {e}", exc_info=True)
-                raise HTTPException(status_code=400, detail=str(e))
-            except FilterEvaluationError as e:
-                logger.error(f"Filter evaluation error: {e}", exc_info=True)
-                raise HTTPException(status_code=500, detail="Filter evaluation failed")
-            except Exception as e:
-                logger.error(f"Unexpected filter error: {e}", exc_info=True)
-                raise HTTPException(status_code=500, detail=f"Filter processing failed: {str(e)}")
-        
-        else:
-            # Без фильтра используем обычную пагинацию
-            logger.info(f"No filter, using standard pagination with start_index={start_index}, count={count}")
-            response = await proxy_service.get_users(
-                headers=headers,
-                start_index=start_index,
-                count=count,
-                attributes=None,  # НЕ передаем в upstream API
-                excluded_attributes=None  # НЕ передаем в upstream API
+                ):
+                    scanned += len(page)
+                    matches.extend(filter_engine.iter_filter(page, filter_expr))
+                _sort_users(matches, sort_by, sort_order)
+                matched = len(matches)
+                page_users = [
+                    project(user) if project is not None else user
+                    for user in matches[start_idx:end_idx]
+                ]
+            else:
+                async for page in proxy_service.iter_users_for_filtering(
+                    headers=headers,
+                    max_results=max_fetch,
+                    attributes=attributes_list,
+                    excluded_attributes=excluded_attributes_list
+                ):
+                    scanned += len(page)
+                    # Один проход по странице: предикат, окно пагинации и
+                    # проекция атрибутов склеены — совпадения вне окна
+                    # только считаются, не собираясь в промежуточный список
+                    for user in filter_engine.iter_filter(page, filter_expr):
+                        if start_idx <= matched < end_idx:
+                            page_users.append(project(user) if project is not None else user)
+                        matched += 1
+                    if matched >= end_idx:
+                        break
+            logger.info("Filter applied to %d users, %d match", scanned, matched)
+
+            # Создаем ответ. totalResults — число совпадений в пределах
+            # просмотренного окна (как и раньше, окно ограничено max_fetch)
+            response = ListResponse(
+                schemas=["urn:ietf:params:scim:api:messages:2.0:ListResponse"],
+                totalResults=matched,
+                startIndex=start_index,
+                itemsPerPage=len(page_users),
+                Resources=page_users
             )
-            logger.info(f"Upstream API returned {len(response.Resources)} users")
+
+            logger.info("Returning %d users (page %d-%d of %d total)",
+                        len(page_users), start_index,
+                        start_index + len(page_users) - 1, matched)
             
-            # Применяем фильтрацию атрибутов на уровне прокси
-            if attributes_list or excluded_attributes_list:
-                logger.info(f"Applying attribute filtering: attributes={attributes_list}, excluded={excluded_attributes_list}")
-                filtered_resources = _apply_attribute_filtering(response.Resources, attributes_list, excluded_attributes_list)
-                
-                # Создаем новый ответ с отфильтрованными атрибутами
-                response = ListResponse(
-                    schemas=response.schemas,
-                    totalResults=response.totalResults,
-                    startIndex=response.startIndex,
-                    itemsPerPage=response.itemsPerPage,
-                    Resources=filtered_resources
-                )
-                logger.info(f"Attribute filtering applied to {len(filtered_resources)} users")
-        
-        return response
-        
-    except UpstreamError as e:
-        logger.error(f"Upstream error: {e}", exc_info=True)
-        raise HTTPException(status_code=e.status_code, detail=e.message)
-    except Exception as e:
-        logger.error(f"Unexpected error in list_users: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal server error")
+        except InvalidFilterError as e:
+            # Ошибка клиента, а не инцидент сервера — стек не собираем
+            logger.error("Invalid filter error: %s", e)
+            raise HTTPException(status_code=400, detail=str(e))
+        except FilterEvaluationError as e:
+            logger.error("Filter evaluation error: %s", e, exc_info=True)
+            raise HTTPException(status_code=500, detail="Filter evaluation failed")
+        # Прочие неожиданные ошибки доходят до _scim_endpoint, который один
+        # раз собирает traceback — без двойного захвата стека на отказ
+    
+    else:
+        # Без фильтра используем обычную пагинацию
+        logger.info("No filter, using standard pagination with start_index=%d, count=%d", start_index, count)
+        response = await proxy_service.get_users(
+            headers=headers,
+            start_index=start_index,
+            count=count,
+            attributes=None,  # НЕ передаем в upstream API
+            excluded_attributes=None,  # НЕ передаем в upstream API
+            sort_by=sort_by,
+            sort_order=sort_order
+        )
+        logger.info("Upstream API returned %d users", len(response.Resources))
+
+        # Применяем фильтрацию атрибутов на уровне прокси
+        if attributes_list or excluded_attributes_list:
+            filtered_resources = _apply_attribute_filtering(response.Resources, attributes_list, excluded_attributes_list)
+            
+            # Создаем новый ответ с отфильтрованными атрибутами
+            response = ListResponse(
+                schemas=response.schemas,
+                totalResults=response.totalResults,
+                startIndex=response.startIndex,
+                itemsPerPage=response.itemsPerPage,
+                Resources=filtered_resources
+            )
+            logger.info("Attribute filtering applied to %d users", len(filtered_resources))
+
+    return response
 
 
 @router.get("/{user_id}", response_model=User)
+@_scim_endpoint
 async def get_user(
     user_id: str,
     request: Request
 ) -> User:
     """Получение пользователя по ID"""
-    
-    try:
-        headers = get_request_headers(request)
-        user = await proxy_service.get_user(user_id, headers)
-        return user
-        
-    except UpstreamError as e:
-        logger.error(f"Upstream error: {e}")
-        raise HTTPException(status_code=e.status_code, detail=e.message)
-    except Exception as e:
-        logger.error(f"Unexpected error in get_user: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    headers = get_request_headers(request)
+    return await proxy_service.get_user(user_id, headers)
+
+
+@router.post("/_batch")
+@_scim_endpoint
+async def batch_get_users(
+    payload: Dict[str, Any],
+    request: Request
+) -> Dict[str, Any]:
+    """Пакетное получение пользователей по списку ID.
+
+    IdP-синки часто вызывают GET /Users/{id} в цикле, платя полный RTT за
+    каждого пользователя. Здесь N запросов едут в одном HTTP-вызове, а к
+    upstream уходят параллельно с ограничением upstream_concurrency.
+    """
+    ids = payload.get("ids")
+    if not isinstance(ids, list) or not ids:
+        raise HTTPException(status_code=400, detail="'ids' must be a non-empty list")
+
+    headers = get_request_headers(request)
+    semaphore = asyncio.Semaphore(get_settings().upstream_concurrency)
+
+    async def fetch_user(user_id: str) -> User:
+        async with semaphore:
+            return await proxy_service.get_user(user_id, headers)
+
+    results = await asyncio.gather(
+        *(fetch_user(user_id) for user_id in ids),
+        return_exceptions=True
+    )
+
+    resources: List[User] = []
+    errors: List[Dict[str, Any]] = []
+    for user_id, result in zip(ids, results):
+        if isinstance(result, UpstreamError):
+            errors.append({"id": user_id, "status": result.status_code, "detail": result.message})
+        elif isinstance(result, Exception):
+            logger.error("Unexpected error in batch get for user %s: %s", user_id, result)
+            errors.append({"id": user_id, "status": 500, "detail": "Internal server error"})
+        else:
+            resources.append(result)
+
+    return {"Resources": resources, "errors": errors}
 
 
 @router.post("", response_model=User, status_code=201)
+@_scim_endpoint
 async def create_user(
     user_data: Dict[str, Any],
     request: Request
 ) -> User:
     """Создание нового пользователя"""
-    
-    try:
-        headers = get_request_headers(request)
-        user = await proxy_service.create_user(user_data, headers)
-        return user
-        
-    except UpstreamError as e:
-        logger.error(f"Upstream error: {e}")
-        raise HTTPException(status_code=e.status_code, detail=e.message)
-    except Exception as e:
-        logger.error(f"Unexpected error in create_user: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    headers = get_request_headers(request)
+    return await proxy_service.create_user(user_data, headers)
 
 
 @router.put("/{user_id}", response_model=User)
+@_scim_endpoint
 async def update_user(
     user_id: str,
     user_data: Dict[str, Any],
     request: Request
 ) -> User:
     """Полное обновление пользователя"""
-    
-    try:
-        headers = get_request_headers(request)
-        user = await proxy_service.update_user(user_id, user_data, headers)
-        return user
-        
-    except UpstreamError as e:
-        logger.error(f"Upstream error: {e}")
-        raise HTTPException(status_code=e.status_code, detail=e.message)
-    except Exception as e:
-        logger.error(f"Unexpected error in update_user: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+    headers = get_request_headers(request)
+    return await proxy_service.update_user(user_id, user_data, headers)
 
 
-async def _adapt_patch_for_upstream(
-    patch_request: PatchRequest,
-    user_id: str,
-    headers: Dict[str, str]
-) -> Dict[str, Any]:
-    """Адаптирует PATCH запрос под требования upstream API"""
-    adapted_operations = []
-    add_operations_to_convert = []
-    
-    # Сначала собираем операции add с фильтрацией, которые нужно преобразовать
-    for op in patch_request.Operations:
+def _fix_patch_schemas(schemas: Optional[List[str]]) -> Optional[List[str]]:
+    """Исправляет известную опечатку в схеме PatchOp (лишний пробел перед версией)"""
+    if schemas:
+        schemas = [schema.replace("urn:ietf:params:scim:api:messages: 2.0:PatchOp",
+                                  "urn:ietf:params:scim:api:messages:2.0:PatchOp") for schema in schemas]
+    return schemas
+
+
+# Короткий TTL-кэш для GET текущего пользователя внутри PATCH: IdP нередко
+# шлют несколько PATCH подряд одному и тому же пользователю, и каждый из них
+# платил полный RTT за повторное чтение. Ключ включает authorization, чтобы
+# разные тенанты не делили записи; после успешного PATCH запись сбрасывается
+_PATCH_GET_TTL = 1.0
+_PATCH_GET_CACHE_MAX = 1024
+_patch_get_cache: Dict[tuple, tuple] = {}
+
+
+def _patch_get_cache_key(user_id: str, headers: Dict[str, str]) -> tuple:
+    return (user_id, headers.get('authorization', ''))
+
+
+async def _get_user_cached(user_id: str, headers: Dict[str, str]):
+    """Возвращает пользователя из кэша или запрашивает его у upstream"""
+    key = _patch_get_cache_key(user_id, headers)
+    now = time.monotonic()
+    hit = _patch_get_cache.get(key)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+
+    user = await proxy_service.get_user(user_id, headers)
+    if len(_patch_get_cache) >= _PATCH_GET_CACHE_MAX:
+        # Дешевая зачистка: выбрасываем просроченные записи, а если их нет —
+        # весь кэш (TTL в секунду делает полную потерю безобидной)
+        expired = [k for k, v in _patch_get_cache.items() if v[0] <= now]
+        for k in expired:
+            _patch_get_cache.pop(k, None)
+        if len(_patch_get_cache) >= _PATCH_GET_CACHE_MAX:
+            _patch_get_cache.clear()
+    _patch_get_cache[key] = (now + _PATCH_GET_TTL, user)
+    return user
+
+
+def _apply_add_ops_sync(current_array: List[Any], ops: List[Any]) -> List[Any]:
+    """Применяет операции add с фильтром к массиву атрибута (чистая функция).
+
+    Выполняется в worker-потоке: внутри только разбор путей и работа со
+    словарями, без I/O.
+    """
+    updated_array = current_array.copy()
+
+    # Индекс {поле: {значение: элемент}} для O(1) поиска вместо
+    # линейного скана массива на каждую операцию
+    index: Dict[str, Dict[Any, Any]] = {}
+    for item in updated_array:
+        if isinstance(item, dict):
+            for key, value in item.items():
+                if isinstance(value, (str, int, float, bool)):
+                    index.setdefault(key, {})[value] = item
+
+    for op in ops:
+        # Парсим путь с фильтром (например, phoneNumbers[type eq "work"].value)
+        match = _PATCH_PATH_RE.match(op.path)
+        if match:
+            filter_field = match.group(2)
+            filter_value = match.group(3).strip('"\'')
+            field_part = match.group(4)
+
+            # Ищем существующий элемент с таким фильтром
+            existing_item = index.get(filter_field, {}).get(filter_value)
+
+            if existing_item:
+                # Обновляем существующий элемент
+                if field_part:
+                    existing_item[field_part] = op.value
+                else:
+                    # Если нет field_part, заменяем весь объект
+                    if isinstance(op.value, dict):
+                        existing_item.update(op.value)
+            else:
+                # Создаем новый элемент
+                new_item = {filter_field: filter_value}
+                if field_part:
+                    new_item[field_part] = op.value
+                elif isinstance(op.value, dict):
+                    new_item.update(op.value)
+                else:
+                    new_item['value'] = op.value
+
+                updated_array.append(new_item)
+                for key, value in new_item.items():
+                    if isinstance(value, (str, int, float, bool)):
+                        index.setdefault(key, {})[value] = new_item
+
+    return updated_array
+
+
+def _normalize_operations(operations: List[Any]) -> tuple:
+    """Нормализует операции PATCH для upstream (чистая функция).
+
+    Возвращает (adapted_operations, add_operations_to_convert): простые
+    операции приводятся к формату upstream, а add с фильтром в пути
+    откладываются для преобразования в replace.
+    """
+    adapted_operations: List[Dict[str, Any]] = []
+    add_operations_to_convert: List[Any] = []
+
+    for op in operations:
         if op.op.lower() == "add" and op.path and "[" in op.path and "]" in op.path:
             add_operations_to_convert.append(op)
         else:
@@ -282,11 +558,11 @@ async def _adapt_patch_for_upstream(
             adapted_op: Dict[str, Any] = {
                 "op": op.op.lower()  # Приводим операцию к нижнему регистру для upstream API
             }
-            
+
             # Добавляем path если указан
             if op.path is not None:
                 adapted_op["path"] = op.path
-            
+
             # Добавляем value если указано, с правильной типизацией
             if op.value is not None:
                 # Специальная обработка для булевых значений
@@ -296,160 +572,140 @@ async def _adapt_patch_for_upstream(
                     adapted_op["value"] = op.value.lower() == 'true'
                 else:
                     adapted_op["value"] = op.value
-            
+
             adapted_operations.append(adapted_op)
-    
+
+    return adapted_operations, add_operations_to_convert
+
+
+async def _adapt_patch_for_upstream(
+    patch_request: PatchRequest,
+    user_id: str,
+    headers: Dict[str, str]
+) -> Dict[str, Any]:
+    """Адаптирует PATCH запрос под требования upstream API.
+
+    Асинхронная оболочка: весь I/O — один GET текущего пользователя, вся
+    трансформация операций вынесена в чистые синхронные функции
+    (_normalize_operations, _apply_add_ops_sync).
+    """
+    # Сначала собираем операции add с фильтрацией, которые нужно преобразовать
+    adapted_operations, add_operations_to_convert = _normalize_operations(patch_request.Operations)
+
+    # Частый случай IdP-синка — только простые replace/remove: возвращаемся
+    # сразу, не доходя до ветки с дополнительным GET к upstream
+    if not add_operations_to_convert:
+        return {
+            "schemas": _fix_patch_schemas(patch_request.schemas),
+            "Operations": adapted_operations
+        }
+
     # Если есть операции add с фильтрацией, преобразуем их
     if add_operations_to_convert:
         logger.info(f"Converting {len(add_operations_to_convert)} add operations with filtering to replace operations")
-        
+
         try:
-            # Получаем текущие данные пользователя
-            current_user = await proxy_service.get_user(user_id, headers)
-            current_user_dict = current_user.dict() if hasattr(current_user, 'dict') else current_user.__dict__
-            
-            # Группируем операции по базовому пути (например, phoneNumbers)
-            operations_by_path = {}
+            # Запрашиваем текущие данные пользователя; группировка операций
+            # выполняется, пока запрос к upstream в полете
+            current_user_task = asyncio.ensure_future(_get_user_cached(user_id, headers))
+
+            # Группируем операции по базовому пути (например, phoneNumbers);
+            # defaultdict — один поиск по хэшу на операцию вместо двух
+            operations_by_path: Dict[str, List[Any]] = defaultdict(list)
             for op in add_operations_to_convert:
-                # Извлекаем базовый путь (например, "phoneNumbers" из "phoneNumbers[type eq \"work\"].value")
-                base_path = op.path.split('[')[0]
-                if base_path not in operations_by_path:
-                    operations_by_path[base_path] = []
+                # Извлекаем базовый путь (например, "phoneNumbers" из "phoneNumbers[type eq \"work\"].value");
+                # partition не создает промежуточный список в отличие от split
+                base_path = op.path.partition('[')[0]
                 operations_by_path[base_path].append(op)
-            
-            # Обрабатываем каждый базовый путь
-            for base_path, ops in operations_by_path.items():
-                logger.info(f"Processing {len(ops)} add operations for path: {base_path}")
-                
-                # Получаем текущий массив
-                current_array = current_user_dict.get(base_path, [])
-                if not isinstance(current_array, list):
-                    current_array = []
-                
-                # Применяем операции add
-                updated_array = current_array.copy()
-                
-                for op in ops:
-                    # Парсим фильтр из path (например, "type eq \"work\"")
-                    if '[' in op.path and ']' in op.path:
-                        filter_part = op.path.split('[')[1].split(']')[0]
-                        field_part = op.path.split('].')[1] if '].' in op.path else None
-                        
-                        # Простой парсинг фильтра "type eq \"work\""
-                        if ' eq ' in filter_part:
-                            filter_field, filter_value = filter_part.split(' eq ')
-                            filter_field = filter_field.strip()
-                            filter_value = filter_value.strip().strip('"\'')
-                            
-                            # Ищем существующий элемент с таким фильтром
-                            existing_item = None
-                            for item in updated_array:
-                                if isinstance(item, dict) and item.get(filter_field) == filter_value:
-                                    existing_item = item
-                                    break
-                            
-                            if existing_item:
-                                # Обновляем существующий элемент
-                                if field_part:
-                                    existing_item[field_part] = op.value
-                                else:
-                                    # Если нет field_part, заменяем весь объект
-                                    if isinstance(op.value, dict):
-                                        existing_item.update(op.value)
-                                logger.info(f"Updated existing item with {filter_field}={filter_value}")
-                            else:
-                                # Создаем новый элемент
-                                new_item = {filter_field: filter_value}
-                                if field_part:
-                                    new_item[field_part] = op.value
-                                elif isinstance(op.value, dict):
-                                    new_item.update(op.value)
-                                else:
-                                    new_item['value'] = op.value
-                                
-                                updated_array.append(new_item)
-                                logger.info(f"Added new item with {filter_field}={filter_value}")
-                
+
+            current_user = await current_user_task
+            # model_dump выполняется Rust-сериализатором pydantic-core,
+            # в отличие от устаревшего .dict()
+            if isinstance(current_user, dict):
+                current_user_dict = current_user
+            elif hasattr(current_user, 'model_dump'):
+                current_user_dict = current_user.model_dump()
+            else:
+                current_user_dict = current_user.__dict__
+
+            # Каждый базовый путь — независимая чистая CPU-работа: уносим ее
+            # в пул потоков, чтобы event loop оставался отзывчивым на больших
+            # массивах, а пути обрабатывались параллельно друг другу
+            tasks = {
+                base_path: asyncio.to_thread(
+                    _apply_add_ops_sync,
+                    current_user_dict.get(base_path)
+                    if isinstance(current_user_dict.get(base_path), list) else [],
+                    ops
+                )
+                for base_path, ops in operations_by_path.items()
+            }
+            updated_arrays = await asyncio.gather(*tasks.values())
+
+            for base_path, updated_array in zip(tasks, updated_arrays):
                 # Создаем операцию replace для всего массива
-                replace_op = {
+                adapted_operations.append({
                     "op": "replace",
                     "path": base_path,
                     "value": updated_array
-                }
-                adapted_operations.append(replace_op)
-                logger.info(f"Created replace operation for {base_path} with {len(updated_array)} items")
-                
+                })
+                logger.info("Created replace operation for %s with %d items", base_path, len(updated_array))
+
         except Exception as e:
             logger.error(f"Failed to convert add operations: {e}")
             # В случае ошибки, пропускаем операции add с предупреждением
             logger.warning("Falling back to skipping add operations with filtering")
     
-    # Исправляем схему если есть опечатка
-    schemas = patch_request.schemas
-    if schemas:
-        schemas = [schema.replace("urn:ietf:params:scim:api:messages: 2.0:PatchOp",
-                                "urn:ietf:params:scim:api:messages:2.0:PatchOp") for schema in schemas]
-    
     return {
-        "schemas": schemas,
+        "schemas": _fix_patch_schemas(patch_request.schemas),
         "Operations": adapted_operations
     }
 
 
 @router.patch("/{user_id}", response_model=User)
+@_scim_endpoint
 async def patch_user(
     user_id: str,
     patch_request: PatchRequest,
     request: Request
 ) -> User:
     """Частичное обновление пользователя через PATCH операции"""
-    
-    try:
-        headers = get_request_headers(request)
-        logger.info(f"Processing PATCH request for user {user_id}")
-        
-        # Валидация операций
-        for i, operation in enumerate(patch_request.Operations):
-            logger.info(f"Operation {i+1}: op={operation.op}, path={operation.path}, value={operation.value}")
-            
-            # Проверяем обязательные поля
-            if operation.op in ["replace", "add"] and operation.value is None and operation.path is None:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Operation {operation.op} requires either 'path' or 'value'"
-                )
-        
-        # Адаптируем данные для upstream API
-        patch_data = await _adapt_patch_for_upstream(patch_request, user_id, headers)
-        logger.info(f"Adapted PATCH data to send upstream: {patch_data}")
-        
-        user = await proxy_service.patch_user(user_id, patch_data, headers)
-        logger.info(f"PATCH operation successful for user {user_id}")
-        return user
-        
-    except UpstreamError as e:
-        logger.error(f"Upstream error for user {user_id}: {e}")
-        raise HTTPException(status_code=e.status_code, detail=e.message)
-    except Exception as e:
-        logger.error(f"Unexpected error in patch_user for user {user_id}: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal server error")
+    headers = get_request_headers(request)
+    logger.info("Processing PATCH request for user %s", user_id)
+
+    # Валидация операций
+    for i, operation in enumerate(patch_request.Operations):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Operation %d: op=%s, path=%s, value=%s", i + 1, operation.op, operation.path, operation.value)
+
+        # Проверяем обязательные поля
+        if operation.op in ["replace", "add"] and operation.value is None and operation.path is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Operation {operation.op} requires either 'path' or 'value'"
+            )
+
+    # Адаптируем данные для upstream API
+    patch_data = await _adapt_patch_for_upstream(patch_request, user_id, headers)
+    # Сериализация patch_data в строку ощутима на больших массивах,
+    # поэтому лог включается только на уровне DEBUG
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Adapted PATCH data to send upstream: %s", patch_data)
+
+    user = await proxy_service.patch_user(user_id, patch_data, headers)
+    # Сбрасываем кэшированное чтение: следующий PATCH должен увидеть результат
+    _patch_get_cache.pop(_patch_get_cache_key(user_id, headers), None)
+    logger.info("PATCH operation successful for user %s", user_id)
+    return user
 
 
 @router.delete("/{user_id}", status_code=204)
+@_scim_endpoint
 async def delete_user(
     user_id: str,
     request: Request
 ):
     """Удаление пользователя"""
-    
-    try:
-        headers = get_request_headers(request)
-        await proxy_service.delete_user(user_id, headers)
-        return None
-        
-    except UpstreamError as e:
-        logger.error(f"Upstream error: {e}")
-        raise HTTPException(status_code=e.status_code, detail=e.message)
-    except Exception as e:
-        logger.error(f"Unexpected error in delete_user: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+    headers = get_request_headers(request)
+    await proxy_service.delete_user(user_id, headers)
+    return None
\ No newline at end of file
@@ -1,7 +1,11 @@
 """Движок для применения SCIM фильтров к данным"""
 
-from typing import List, Any, Dict, Union, TypeVar
-import re
+import logging
+import operator
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, TypeVar, Union
+
+from pydantic import BaseModel
 
 from ..models.filters import (
     FilterExpression, AttributeExpression, LogicalExpression,
@@ -10,229 +14,535 @@ from ..models.filters import (
 )
 from ..utils.exceptions import FilterEvaluationError
 
+logger = logging.getLogger(__name__)
+
 # Универсальный тип для SCIM ресурсов
 T = TypeVar('T')
 
+# Предикат, полученный компиляцией выражения фильтра
+Predicate = Callable[[Any], bool]
+
+
+@lru_cache(maxsize=64)
+def _alias_to_field(model_cls) -> Dict[str, str]:
+    """Карта alias -> имя поля pydantic-модели (вычисляется один раз на класс)"""
+    return {
+        (field.alias or name): name
+        for name, field in model_cls.model_fields.items()
+    }
+
 
 class FilterEngine:
-    """Движок для применения SCIM фильтров к данным"""
-    
+    """Движок для применения SCIM фильтров к данным.
+
+    Вместо рекурсивного обхода AST на каждый ресурс выражение один раз
+    компилируется в замыкание-предикат: диспетчеризация по типам узлов и
+    операторам выполняется на этапе компиляции, а не в горячем цикле.
+    Скомпилированные предикаты кэшируются по AST (узлы — frozen dataclasses).
+    """
+
+    # Движок не несет состояния экземпляра — пустые __slots__ убирают
+    # per-instance __dict__
+    __slots__ = ()
+
     def apply_filter(self, resources: List[T], filter_expr: FilterExpression) -> List[T]:
         """Применяет фильтр к списку SCIM ресурсов (пользователи, группы и т.д.)"""
         if not filter_expr:
             return resources
-        
+
+        predicate = _compile_filter(filter_expr)
+
         filtered_resources = []
         for resource in resources:
             try:
-                if self._evaluate_expression(resource, filter_expr):
+                if predicate(resource):
                     filtered_resources.append(resource)
             except Exception as e:
-                # Логируем ошибку, но продолжаем обработку
-                resource_id = getattr(resource, 'id', 'unknown')
-                print(f"Error evaluating filter for resource {resource_id}: {e}")
+                # Логируем ошибку, но продолжаем обработку; guard избавляет
+                # горячий цикл даже от getattr при выключенном DEBUG
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Error evaluating filter for resource %s: %s",
+                                 getattr(resource, 'id', 'unknown'), e)
                 continue
-        
+
         return filtered_resources
-    
-    def _evaluate_expression(self, resource: Any, expr: FilterExpression) -> bool:
-        """Оценивает выражение фильтра для SCIM ресурса"""
+
+    def iter_filter(self, resources: List[T], filter_expr: FilterExpression):
+        """Ленивый вариант apply_filter: отдает совпадения по мере обхода.
+
+        Позволяет вызывающему коду склеить фильтрацию, пагинацию и проекцию
+        атрибутов в один проход по ресурсам без промежуточных списков.
+        """
+        if not filter_expr:
+            yield from resources
+            return
+
+        predicate = _compile_filter(filter_expr)
+        for resource in resources:
+            try:
+                if predicate(resource):
+                    yield resource
+            except Exception as e:
+                # Логируем ошибку, но продолжаем обработку; guard избавляет
+                # горячий цикл даже от getattr при выключенном DEBUG
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Error evaluating filter for resource %s: %s",
+                                 getattr(resource, 'id', 'unknown'), e)
+                continue
+
+    def apply_filter_page(
+        self,
+        resources: List[T],
+        filter_expr: FilterExpression,
+        start_index: int,
+        count: int
+    ) -> tuple:
+        """Применяет фильтр и пагинацию за один проход.
+
+        Возвращает (page, total): total — общее число совпадений (нужно
+        для totalResults), но в памяти собирается только запрошенная
+        страница вместо полного списка и его среза.
+        """
+        if not filter_expr:
+            return resources[start_index:start_index + count], len(resources)
+
+        predicate = _compile_filter(filter_expr)
+        end_index = start_index + count
+
+        page = []
+        total = 0
+        for resource in resources:
+            try:
+                if predicate(resource):
+                    if start_index <= total < end_index:
+                        page.append(resource)
+                    total += 1
+            except Exception as e:
+                # Логируем ошибку, но продолжаем обработку; guard избавляет
+                # горячий цикл даже от getattr при выключенном DEBUG
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Error evaluating filter for resource %s: %s",
+                                 getattr(resource, 'id', 'unknown'), e)
+                continue
+
+        return page, total
+
+    # Операторы, для которых строковая константа фильтра приводится к нижнему
+    # регистру один раз при компиляции (сравнения регистронезависимые)
+    _FOLD_OPERATORS = frozenset({
+        FilterOperator.EQ, FilterOperator.NE, FilterOperator.CO,
+        FilterOperator.SW, FilterOperator.EW,
+    })
+
+    # Числовые операторы: C-функции из модуля operator для специализированных
+    # компараторов с заранее приведенной константой
+    _NUMERIC_OP_FUNCS = {
+        FilterOperator.GT: operator.gt,
+        FilterOperator.GE: operator.ge,
+        FilterOperator.LT: operator.lt,
+        FilterOperator.LE: operator.le,
+    }
+
+    def compile(self, expr: FilterExpression) -> Predicate:
+        """Компилирует выражение фильтра в предикат над одним ресурсом"""
         if isinstance(expr, AttributeExpression):
-            return self._evaluate_attribute_expression(resource, expr)
-        
+            return self._compile_attribute_expression(expr)
+
         elif isinstance(expr, LogicalExpression):
-            return self._evaluate_logical_expression(resource, expr)
-        
+            return self._compile_logical_expression(expr)
+
         elif isinstance(expr, GroupExpression):
-            return self._evaluate_expression(resource, expr.expression)
-        
+            return self.compile(expr.expression)
+
         elif isinstance(expr, ComplexAttributeExpression):
-            return self._evaluate_complex_attribute_expression(resource, expr)
-        
+            return self._compile_complex_attribute_expression(expr)
+
         else:
             raise FilterEvaluationError(f"Unknown expression type: {type(expr)}")
-    
-    def _evaluate_attribute_expression(self, resource: Any, expr: AttributeExpression) -> bool:
-        """Оценивает простое выражение атрибута"""
-        value = self._get_attribute_value(resource, expr.attribute)
-        
+
+    def _make_attr_getter(self, parts: tuple) -> Callable[[Any], Any]:
+        """Строит аксессор значения атрибута по разобранному пути"""
+        if len(parts) == 1:
+            # Подавляющее большинство фильтров — один сегмент (userName eq
+            # ...): специализированный доступ без цикла по частям пути
+            attr = parts[0]
+
+            def get_attr(resource: Any) -> Any:
+                if isinstance(resource, dict):
+                    return resource.get(attr)
+                if isinstance(resource, BaseModel):
+                    field_name = _alias_to_field(type(resource)).get(attr, attr)
+                    return getattr(resource, field_name, None)
+                d = getattr(resource, '__dict__', None)
+                return d.get(attr) if d is not None else None
+
+            return get_attr
+
+        walk = self._get_attribute_value_parts
+        return lambda resource: walk(resource, parts)
+
+    def _compile_attribute_expression(self, expr: AttributeExpression) -> Predicate:
+        """Компилирует простое выражение атрибута"""
+        # Путь атрибута разбивается один раз при компиляции и попадает в
+        # замыкание кортежем — без split на каждый ресурс
+        parts = tuple(expr.attribute.split('.'))
+        get_attr = self._make_attr_getter(parts)
+
         if expr.operator == FilterOperator.PR:
-            return value is not None
-        
-        if value is None:
-            return False
-        
-        return self._compare_values(value, expr.operator, expr.value)
-    
-    def _evaluate_logical_expression(self, resource: Any, expr: LogicalExpression) -> bool:
-        """Оценивает логическое выражение"""
+            return lambda resource: get_attr(resource) is not None
+
+        negate = expr.operator == FilterOperator.NE
+        if negate:
+            comparator = self._equals
+        elif expr.operator in self._NUMERIC_OP_FUNCS:
+            comparator = self._compile_numeric_comparator(expr.operator, expr.value)
+        elif expr.operator in (FilterOperator.CO, FilterOperator.SW, FilterOperator.EW) and isinstance(expr.value, str):
+            comparator = self._compile_string_comparator(expr.operator, expr.value.lower())
+        else:
+            comparator = self._OP_TABLE.get(expr.operator)
+            if comparator is None:
+                raise FilterEvaluationError(f"Unknown operator: {expr.operator}")
+        expected = expr.value
+        # Константа из строки фильтра опускается в нижний регистр один раз
+        # здесь, а не на каждый ресурс внутри компаратора
+        if isinstance(expected, str) and expr.operator in self._FOLD_OPERATORS:
+            expected = expected.lower()
+
+        def predicate(resource: Any) -> bool:
+            value = get_attr(resource)
+            if value is None:
+                return False
+            try:
+                result = comparator(value, expected)
+            except FilterEvaluationError:
+                raise
+            except Exception as e:
+                raise FilterEvaluationError(f"Error comparing values: {e}")
+            return not result if negate else result
+
+        return predicate
+
+    def _compile_numeric_comparator(self, op: FilterOperator, expected: Any) -> Callable[[Any, Any], bool]:
+        """Строит компаратор для gt/ge/lt/le с предвычисленной константой.
+
+        float(expected) выполняется один раз при компиляции; значения
+        ресурса, уже являющиеся числами, сравниваются без приведения.
+        """
+        op_func = self._NUMERIC_OP_FUNCS[op]
+        try:
+            expected_num = float(expected)
+        except (ValueError, TypeError):
+            # Константа нечисловая — сравнение всегда ложно, как и раньше
+            return lambda actual, _expected: False
+
+        def comparator(actual: Any, _expected: Any) -> bool:
+            if type(actual) in (int, float):
+                return op_func(actual, expected_num)
+            try:
+                return op_func(float(actual), expected_num)
+            except (ValueError, TypeError):
+                return False
+
+        return comparator
+
+    def _compile_string_comparator(self, op: FilterOperator, expected_lower: str) -> Callable[[Any, Any], bool]:
+        """Строит компаратор для co/sw/ew с быстрым отсевом по длине.
+
+        Значение короче константы не может совпасть — отказ без .lower().
+        Для sw/ew в нижний регистр опускается только срез нужной длины, а не
+        вся строка (на длинных displayName это заметно).
+        """
+        expected_len = len(expected_lower)
+        if expected_len == 0:
+            # Пустая константа совпадает с любой строкой (как у str.startswith)
+            return lambda actual, _expected: isinstance(actual, str)
+
+        if op == FilterOperator.CO:
+            def comparator(actual: Any, _expected: Any) -> bool:
+                if not isinstance(actual, str) or len(actual) < expected_len:
+                    return False
+                return expected_lower in actual.lower()
+        elif op == FilterOperator.SW:
+            def comparator(actual: Any, _expected: Any) -> bool:
+                if not isinstance(actual, str) or len(actual) < expected_len:
+                    return False
+                return actual[:expected_len].lower() == expected_lower
+        else:  # EW
+            def comparator(actual: Any, _expected: Any) -> bool:
+                if not isinstance(actual, str) or len(actual) < expected_len:
+                    return False
+                return actual[-expected_len:].lower() == expected_lower
+
+        return comparator
+
+    # Относительная стоимость операторов для перестановки операндов AND/OR:
+    # точные сравнения дешевле префиксных, подстрочный поиск — самый дорогой
+    _OPERATOR_COSTS = {
+        FilterOperator.EQ: 1,
+        FilterOperator.NE: 1,
+        FilterOperator.PR: 1,
+        FilterOperator.GT: 2,
+        FilterOperator.GE: 2,
+        FilterOperator.LT: 2,
+        FilterOperator.LE: 2,
+        FilterOperator.SW: 3,
+        FilterOperator.EW: 3,
+        FilterOperator.CO: 5,
+    }
+
+    def _estimate_cost(self, expr: FilterExpression) -> int:
+        """Оценивает стоимость вычисления узла AST (эвристика)"""
+        if isinstance(expr, AttributeExpression):
+            return self._OPERATOR_COSTS.get(expr.operator, 3)
+        if isinstance(expr, GroupExpression):
+            return self._estimate_cost(expr.expression)
+        if isinstance(expr, LogicalExpression):
+            left = self._estimate_cost(expr.left) if expr.left else 0
+            right = self._estimate_cost(expr.right) if expr.right else 0
+            return left + right
+        if isinstance(expr, ComplexAttributeExpression):
+            # Скан массива с предикатом на каждый элемент
+            return 20
+        return 10
+
+    # Строковые операторы, безопасные для слияния клауз по одному атрибуту:
+    # на нестроковом значении каждая из них дает False (NE сюда не входит)
+    _FUSABLE_STRING_OPS = frozenset({
+        FilterOperator.EQ, FilterOperator.CO,
+        FilterOperator.SW, FilterOperator.EW,
+    })
+
+    @classmethod
+    def _is_fusable_string_clause(cls, expr: FilterExpression) -> bool:
+        return (isinstance(expr, AttributeExpression)
+                and expr.operator in cls._FUSABLE_STRING_OPS
+                and isinstance(expr.value, str)
+                and '.' not in expr.attribute)
+
+    @staticmethod
+    def _compile_lowered_clause(op: FilterOperator, expected_lower: str) -> Callable[[str], bool]:
+        """Клауза над строкой, уже опущенной в нижний регистр"""
+        if op == FilterOperator.EQ:
+            return lambda low: low == expected_lower
+        if op == FilterOperator.CO:
+            return lambda low: expected_lower in low
+        if op == FilterOperator.SW:
+            return lambda low: low.startswith(expected_lower)
+        return lambda low: low.endswith(expected_lower)  # EW
+
+    def _try_compile_fused(self, expr: LogicalExpression) -> Union[Predicate, None]:
+        """Сливает AND/OR двух строковых клауз по одному атрибуту.
+
+        Для фильтров вида userName sw "a" and userName ew "z" значение
+        атрибута извлекается и опускается в нижний регистр один раз на
+        ресурс, а не в каждой клаузе отдельно.
+        """
+        left_expr, right_expr = expr.left, expr.right
+        if not (self._is_fusable_string_clause(left_expr)
+                and self._is_fusable_string_clause(right_expr)
+                and left_expr.attribute == right_expr.attribute):
+            return None
+
+        get_attr = self._make_attr_getter((left_expr.attribute,))
+        left_clause = self._compile_lowered_clause(left_expr.operator, left_expr.value.lower())
+        right_clause = self._compile_lowered_clause(right_expr.operator, right_expr.value.lower())
+
+        if expr.operator == LogicalOperator.AND:
+            def predicate(resource: Any) -> bool:
+                value = get_attr(resource)
+                if not isinstance(value, str):
+                    return False
+                low = value.lower()
+                return left_clause(low) and right_clause(low)
+        else:
+            def predicate(resource: Any) -> bool:
+                value = get_attr(resource)
+                if not isinstance(value, str):
+                    return False
+                low = value.lower()
+                return left_clause(low) or right_clause(low)
+
+        return predicate
+
+    def _compile_logical_expression(self, expr: LogicalExpression) -> Predicate:
+        """Компилирует логическое выражение"""
         if expr.operator == LogicalOperator.NOT:
             if expr.left is None:
                 raise FilterEvaluationError("NOT expression requires left operand")
-            return not self._evaluate_expression(resource, expr.left)
-        
-        elif expr.operator == LogicalOperator.AND:
-            if expr.left is None or expr.right is None:
-                raise FilterEvaluationError("AND expression requires both operands")
+            operand = self.compile(expr.left)
+            return lambda resource: not operand(resource)
+
+        if expr.operator not in (LogicalOperator.AND, LogicalOperator.OR):
+            raise FilterEvaluationError(f"Unknown logical operator: {expr.operator}")
+
+        if expr.left is None or expr.right is None:
+            raise FilterEvaluationError(f"{expr.operator.value.upper()} expression requires both operands")
+
+        # Обе клаузы по одному строковому атрибуту — значение читается и
+        # лоуэркейсится один раз
+        fused = self._try_compile_fused(expr)
+        if fused is not None:
+            return fused
+
+        # AND/OR коммутативны, а предикаты чисты (без побочных эффектов),
+        # поэтому дешевый операнд ставится первым: short-circuit чаще
+        # отсекает дорогой co/скан массива
+        left_expr, right_expr = expr.left, expr.right
+        if self._estimate_cost(right_expr) < self._estimate_cost(left_expr):
+            left_expr, right_expr = right_expr, left_expr
+
+        left = self.compile(left_expr)
+        right = self.compile(right_expr)
+        if expr.operator == LogicalOperator.AND:
             # Ранний выход для AND
-            left_result = self._evaluate_expression(resource, expr.left)
-            if not left_result:
-                return False
-            return self._evaluate_expression(resource, expr.right)
-        
-        elif expr.operator == LogicalOperator.OR:
-            if expr.left is None or expr.right is None:
-                raise FilterEvaluationError("OR expression requires both operands")
-            # Ранний выход для OR
-            left_result = self._evaluate_expression(resource, expr.left)
-            if left_result:
-                return True
-            return self._evaluate_expression(resource, expr.right)
-        
+            return lambda resource: left(resource) and right(resource)
+        # Ранний выход для OR
+        return lambda resource: left(resource) or right(resource)
+
+    def _compile_complex_attribute_expression(self, expr: ComplexAttributeExpression) -> Predicate:
+        """Компилирует сложное выражение атрибута (массивы)"""
+        parts = tuple(expr.attribute.split('.'))
+        sub_parts = tuple(expr.sub_attribute.split('.')) if expr.sub_attribute else None
+        get_value = self._get_attribute_value_parts
+        item_predicate = self.compile(expr.filter_expression)
+
+        # Проверка элементов массива через any() по генератору: цикл крутится
+        # на уровне C и останавливается на первом совпадении; вариант с
+        # под-атрибутом выбирается один раз при компиляции
+        if sub_parts is None:
+            def predicate(resource: Any) -> bool:
+                array_value = get_value(resource, parts)
+                if not isinstance(array_value, list):
+                    return False
+                return any(item_predicate(item) for item in array_value)
         else:
-            raise FilterEvaluationError(f"Unknown logical operator: {expr.operator}")
-    
-    def _evaluate_complex_attribute_expression(self, resource: Any, expr: ComplexAttributeExpression) -> bool:
-        """Оценивает сложное выражение атрибута (массивы)"""
-        array_value = self._get_attribute_value(resource, expr.attribute)
-        
-        if not isinstance(array_value, list):
-            return False
-        
-        # Проверяем каждый элемент массива
-        for item in array_value:
-            # Создаем временный объект для оценки фильтра
-            if isinstance(item, dict):
-                # Работаем с dict напрямую
-                temp_resource = type('TempResource', (), item)()
-            else:
-                temp_resource = item
-            
-            if self._evaluate_expression(temp_resource, expr.filter_expression):
-                # Если есть под-атрибут, проверяем его
-                if expr.sub_attribute:
-                    sub_value = self._get_attribute_value(temp_resource, expr.sub_attribute)
-                    return sub_value is not None
-                return True
-        
-        return False
-    
+            def predicate(resource: Any) -> bool:
+                array_value = get_value(resource, parts)
+                if not isinstance(array_value, list):
+                    return False
+                return any(
+                    item_predicate(item) and get_value(item, sub_parts) is not None
+                    for item in array_value
+                )
+
+        return predicate
+
     def _get_attribute_value(self, resource: Any, attribute_path: str) -> Any:
         """Получает значение атрибута по пути (поддерживает вложенные атрибуты)"""
+        return self._get_attribute_value_parts(resource, tuple(attribute_path.split('.')))
+
+    def _get_attribute_value_parts(self, resource: Any, parts: tuple) -> Any:
+        """Получает значение атрибута по заранее разобранному пути.
+
+        Pydantic-модели обходятся напрямую через getattr (alias разрешается
+        по кэшированной карте model_fields), без сериализации всей модели в
+        словарь ради чтения одного поля.
+        """
         try:
-            # Преобразуем ресурс в словарь для удобства
-            if hasattr(resource, 'dict') and callable(getattr(resource, 'dict')):
-                # Pydantic модель
-                resource_dict = resource.dict(by_alias=True)
-            elif hasattr(resource, '__dict__'):
-                resource_dict = resource.__dict__
-            elif isinstance(resource, dict):
-                resource_dict = resource
-            else:
-                return None
-            
-            # Разбиваем путь на части
-            parts = attribute_path.split('.')
-            current_value = resource_dict
-            
+            current_value = resource
+
             for part in parts:
                 if isinstance(current_value, dict):
                     current_value = current_value.get(part)
+                elif isinstance(current_value, BaseModel):
+                    field_name = _alias_to_field(type(current_value)).get(part, part)
+                    current_value = getattr(current_value, field_name, None)
+                elif hasattr(current_value, '__dict__'):
+                    current_value = current_value.__dict__.get(part)
                 else:
                     return None
-                
+
                 if current_value is None:
                     return None
-            
+
             return current_value
-            
+
         except Exception:
             return None
     
-    def _compare_values(self, actual: Any, operator: FilterOperator, expected: Any) -> bool:
-        """Сравнивает значения согласно оператору"""
-        try:
-            if operator == FilterOperator.EQ:
-                return self._equals(actual, expected)
-            
-            elif operator == FilterOperator.NE:
-                return not self._equals(actual, expected)
-            
-            elif operator == FilterOperator.CO:
-                return self._contains(actual, expected)
-            
-            elif operator == FilterOperator.SW:
-                return self._starts_with(actual, expected)
-            
-            elif operator == FilterOperator.EW:
-                return self._ends_with(actual, expected)
-            
-            elif operator == FilterOperator.GT:
-                return self._greater_than(actual, expected)
-            
-            elif operator == FilterOperator.GE:
-                return self._greater_equal(actual, expected)
-            
-            elif operator == FilterOperator.LT:
-                return self._less_than(actual, expected)
-            
-            elif operator == FilterOperator.LE:
-                return self._less_equal(actual, expected)
-            
-            else:
-                raise FilterEvaluationError(f"Unknown operator: {operator}")
-                
-        except Exception as e:
-            raise FilterEvaluationError(f"Error comparing values: {e}")
-    
-    def _equals(self, actual: Any, expected: Any) -> bool:
-        """Проверка на равенство"""
+    @staticmethod
+    def _equals(actual: Any, expected: Any) -> bool:
+        """Проверка на равенство (expected уже в нижнем регистре)"""
         if isinstance(actual, str) and isinstance(expected, str):
-            return actual.lower() == expected.lower()  # Case-insensitive для строк
+            return actual.lower() == expected  # Case-insensitive для строк
         return actual == expected
-    
-    def _contains(self, actual: Any, expected: Any) -> bool:
-        """Проверка на содержание"""
+
+    @staticmethod
+    def _contains(actual: Any, expected: Any) -> bool:
+        """Проверка на содержание (expected уже в нижнем регистре)"""
         if not isinstance(actual, str) or not isinstance(expected, str):
             return False
-        return expected.lower() in actual.lower()
-    
-    def _starts_with(self, actual: Any, expected: Any) -> bool:
-        """Проверка на начало строки"""
+        return expected in actual.lower()
+
+    @staticmethod
+    def _starts_with(actual: Any, expected: Any) -> bool:
+        """Проверка на начало строки (expected уже в нижнем регистре)"""
         if not isinstance(actual, str) or not isinstance(expected, str):
             return False
-        return actual.lower().startswith(expected.lower())
-    
-    def _ends_with(self, actual: Any, expected: Any) -> bool:
-        """Проверка на окончание строки"""
+        return actual.lower().startswith(expected)
+
+    @staticmethod
+    def _ends_with(actual: Any, expected: Any) -> bool:
+        """Проверка на окончание строки (expected уже в нижнем регистре)"""
         if not isinstance(actual, str) or not isinstance(expected, str):
             return False
-        return actual.lower().endswith(expected.lower())
+        return actual.lower().endswith(expected)
     
-    def _greater_than(self, actual: Any, expected: Any) -> bool:
+    @staticmethod
+    def _greater_than(actual: Any, expected: Any) -> bool:
         """Проверка больше"""
         try:
             return float(actual) > float(expected)
         except (ValueError, TypeError):
             return False
     
-    def _greater_equal(self, actual: Any, expected: Any) -> bool:
+    @staticmethod
+    def _greater_equal(actual: Any, expected: Any) -> bool:
         """Проверка больше или равно"""
         try:
             return float(actual) >= float(expected)
         except (ValueError, TypeError):
             return False
     
-    def _less_than(self, actual: Any, expected: Any) -> bool:
+    @staticmethod
+    def _less_than(actual: Any, expected: Any) -> bool:
         """Проверка меньше"""
         try:
             return float(actual) < float(expected)
         except (ValueError, TypeError):
             return False
     
-    def _less_equal(self, actual: Any, expected: Any) -> bool:
+    @staticmethod
+    def _less_equal(actual: Any, expected: Any) -> bool:
         """Проверка меньше или равно"""
         try:
             return float(actual) <= float(expected)
         except (ValueError, TypeError):
-            return False
\ No newline at end of file
+            return False
+
+    # Таблица операторов сравнения: компаратор выбирается одним поиском по
+    # словарю на этапе компиляции и попадает в замыкание как прямая функция
+    _OP_TABLE = {
+        FilterOperator.EQ: _equals.__func__,
+        FilterOperator.CO: _contains.__func__,
+        FilterOperator.SW: _starts_with.__func__,
+        FilterOperator.EW: _ends_with.__func__,
+        FilterOperator.GT: _greater_than.__func__,
+        FilterOperator.GE: _greater_equal.__func__,
+        FilterOperator.LT: _less_than.__func__,
+        FilterOperator.LE: _less_equal.__func__,
+    }
+
+# Общий экземпляр движка: состояния у него нет, поэтому один объект
+# обслуживает все роутеры (и служит компилятором для кэша ниже)
+filter_engine = FilterEngine()
+
+
+@lru_cache(maxsize=256)
+def _compile_filter(filter_expr: FilterExpression) -> Predicate:
+    """Возвращает скомпилированный предикат для выражения фильтра.
+
+    Повторные запросы с тем же фильтром (типичный паттерн SCIM-поллеров)
+    переиспользуют готовое замыкание вместо повторного обхода AST.
+    """
+    return filter_engine.compile(filter_expr)
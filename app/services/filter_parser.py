@@ -1,12 +1,15 @@
 """Парсер SCIM фильтров согласно RFC 7644"""
 
 import re
+import sys
+from functools import lru_cache
 from typing import Optional, List, Tuple, Any
 
+from ..config import get_settings
 from ..models.filters import (
     FilterExpression, AttributeExpression, LogicalExpression, 
     GroupExpression, ComplexAttributeExpression,
-    FilterOperator, LogicalOperator
+    FilterOperator, LogicalOperator, lookup_filter_op
 )
 from ..utils.exceptions import InvalidFilterError
 
@@ -30,7 +33,20 @@ class FilterParser:
         ('DOT', r'\.'),
         ('WHITESPACE', r'\s+'),
     ]
-    
+
+    # Один мастер-regex с именованными группами вместо перебора паттернов с
+    # re.compile на каждой позиции: вся строка токенизируется одним проходом
+    # движка re, порядок альтернатив повторяет приоритет TOKEN_PATTERNS
+    _MASTER_RE = re.compile(
+        '|'.join(f'(?P<{name}>{pattern})' for name, pattern in TOKEN_PATTERNS),
+        re.IGNORECASE
+    )
+
+
+    # Фиксированный набор атрибутов: без per-instance __dict__ доступ
+    # к tokens/position в цикле разбора дешевле
+    __slots__ = ('tokens', 'position')
+
     def __init__(self):
         self.tokens: List[Tuple[str, str]] = []
         self.position: int = 0
@@ -51,29 +67,31 @@ class FilterParser:
         except IndexError:
             raise InvalidFilterError("Unexpected end of filter")
     
+    # Токены с ограниченным алфавитом: значение нормализуется к нижнему
+    # регистру и интернируется еще при токенизации, чтобы парсер сравнивал
+    # интернированные строки без .lower() на каждой проверке
+    _NORMALIZED_TOKEN_TYPES = frozenset({'OPERATOR', 'LOGICAL', 'BOOLEAN', 'NULL'})
+
     def _tokenize(self, filter_string: str) -> List[Tuple[str, str]]:
         """Разбивает строку на токены"""
         tokens = []
         position = 0
-        
-        while position < len(filter_string):
-            matched = False
-            
-            for token_type, pattern in self.TOKEN_PATTERNS:
-                regex = re.compile(pattern, re.IGNORECASE)
-                match = regex.match(filter_string, position)
-                
-                if match:
-                    value = match.group(0)
-                    if token_type != 'WHITESPACE':  # Игнорируем пробелы
-                        tokens.append((token_type, value))
-                    position = match.end()
-                    matched = True
-                    break
-            
-            if not matched:
+
+        for match in self._MASTER_RE.finditer(filter_string):
+            if match.start() != position:
+                # Между совпадениями остался неразобранный символ
                 raise InvalidFilterError(f"Invalid character at position {position}: {filter_string[position]}")
-        
+            token_type = match.lastgroup
+            if token_type != 'WHITESPACE':  # Игнорируем пробелы
+                value = match.group()
+                if token_type in self._NORMALIZED_TOKEN_TYPES:
+                    value = sys.intern(value.lower())
+                tokens.append((token_type, value))
+            position = match.end()
+
+        if position < len(filter_string):
+            raise InvalidFilterError(f"Invalid character at position {position}: {filter_string[position]}")
+
         return tokens
     
     def _current_token(self) -> Optional[Tuple[str, str]]:
@@ -102,7 +120,7 @@ class FilterParser:
         current = self._current_token()
         while (current and
                current[0] == 'LOGICAL' and
-               current[1].lower() == 'or'):
+               current[1] == 'or'):
             self._consume_token('LOGICAL')
             right = self._parse_logical_and()
             left = LogicalExpression(operator=LogicalOperator.OR, left=left, right=right)
@@ -117,7 +135,7 @@ class FilterParser:
         current = self._current_token()
         while (current and
                current[0] == 'LOGICAL' and
-               current[1].lower() == 'and'):
+               current[1] == 'and'):
             self._consume_token('LOGICAL')
             right = self._parse_logical_not()
             left = LogicalExpression(operator=LogicalOperator.AND, left=left, right=right)
@@ -130,7 +148,7 @@ class FilterParser:
         current = self._current_token()
         if (current and
             current[0] == 'LOGICAL' and
-            current[1].lower() == 'not'):
+            current[1] == 'not'):
             self._consume_token('LOGICAL')
             expression = self._parse_primary()
             return LogicalExpression(operator=LogicalOperator.NOT, left=expression)
@@ -169,7 +187,9 @@ class FilterParser:
         
         # Простое выражение атрибута
         operator_token = self._consume_token('OPERATOR')
-        operator = FilterOperator(operator_token[1].lower())
+        operator = lookup_filter_op(operator_token[1])
+        if operator is None:
+            raise InvalidFilterError(f"Unknown operator: {operator_token[1]}")
         
         # Для оператора pr значение не нужно
         if operator == FilterOperator.PR:
@@ -199,30 +219,53 @@ class FilterParser:
             sub_attribute=sub_attribute
         )
     
+    @staticmethod
+    def _parse_string_value(raw: str) -> str:
+        # Убираем кавычки и обрабатываем escape-последовательности
+        return raw[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+
+    @staticmethod
+    def _parse_number_value(raw: str) -> Any:
+        return float(raw) if '.' in raw else int(raw)
+
+    @staticmethod
+    def _parse_boolean_value(raw: str) -> bool:
+        # Токен уже нормализован к нижнему регистру при токенизации
+        return raw == 'true'
+
+    @staticmethod
+    def _parse_null_value(raw: str) -> None:
+        return None
+
+    # Таблица разборщиков литералов: один поиск по словарю вместо цепочки
+    # if/elif по типу токена
+    _VALUE_PARSERS = {
+        'STRING': _parse_string_value.__func__,
+        'NUMBER': _parse_number_value.__func__,
+        'BOOLEAN': _parse_boolean_value.__func__,
+        'NULL': _parse_null_value.__func__,
+    }
+
     def _parse_value(self) -> Any:
         """Парсит значения"""
         token = self._current_token()
-        
+
         if not token:
             raise InvalidFilterError("Expected value")
-        
-        if token[0] == 'STRING':
-            self._consume_token('STRING')
-            # Убираем кавычки и обрабатываем escape-последовательности
-            return token[1][1:-1].replace('\\"', '"').replace('\\\\', '\\')
-        
-        elif token[0] == 'NUMBER':
-            self._consume_token('NUMBER')
-            value = token[1]
-            return float(value) if '.' in value else int(value)
-        
-        elif token[0] == 'BOOLEAN':
-            self._consume_token('BOOLEAN')
-            return token[1].lower() == 'true'
-        
-        elif token[0] == 'NULL':
-            self._consume_token('NULL')
-            return None
-        
-        else:
-            raise InvalidFilterError(f"Expected value, got {token[0]}")
\ No newline at end of file
+
+        parser = self._VALUE_PARSERS.get(token[0])
+        if parser is None:
+            raise InvalidFilterError(f"Expected value, got {token[0]}")
+
+        self._consume_token(token[0])
+        return parser(token[1])
+
+@lru_cache(maxsize=get_settings().cache_max_size)
+def parse_filter(filter_string: str) -> FilterExpression:
+    """Парсит фильтр с кэшированием результата по строке фильтра.
+
+    SCIM клиенты (Okta, Azure AD и т.п.) шлют одни и те же шаблоны фильтров
+    многократно; выражения фильтра неизменяемы (frozen dataclass), поэтому
+    повторные запросы отдают готовое дерево без повторного парсинга.
+    """
+    return FilterParser().parse(filter_string)
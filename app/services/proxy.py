@@ -2,49 +2,176 @@
 
 import httpx
 import logging
-from typing import Dict, Any, Optional, List
+import orjson
+from functools import wraps
+from typing import Dict, Any, Optional, List, Union
 import asyncio
-from urllib.parse import urljoin, urlparse, parse_qs, urlencode
+import random
+from urllib.parse import quote
 
-from ..config import settings
+from ..config import (
+    get_settings, MAX_FILTER_FETCH_SIZE, TRUST_UPSTREAM, UPSTREAM_BASE_URL
+)
 from ..models.scim import User, ListResponse, Group, GroupListResponse
 from ..utils.exceptions import UpstreamError
 
+# Заголовки, которые проксируются в upstream (аутентификация и маршрутизация);
+# frozenset дает O(1) проверку принадлежности по нижнему регистру
+_IMPORTANT_HEADERS = frozenset({
+    'authorization',
+    'x-api-key',
+    'x-auth-token',
+    'bearer',
+    'cookie',
+    'x-forwarded-for',
+    'x-real-ip',
+    'user-agent',
+})
+
+# Заголовки по умолчанию для каждого upstream-запроса
+_DEFAULT_HEADERS = {
+    'Accept': 'application/scim+json',
+    'User-Agent': 'SCIM-Proxy/1.0.0',
+}
+
+# Повтор upstream-запросов при временной недоступности (429/503)
+_RETRY_STATUSES = frozenset({429, 503})
+_RETRY_ATTEMPTS = 3
+
+# Пути upstream-ресурсов: коллекции как готовые строки, отдельные ресурсы
+# как %-шаблоны — конкатенация строк на каждый запрос не нужна
+_USERS_URL = "/Users"
+_GROUPS_URL = "/Groups"
+_USER_ID_TMPL = "/Users/%s"
+_GROUP_ID_TMPL = "/Groups/%s"
+
+
+def _err_preview(response: httpx.Response) -> str:
+    """Ограниченный фрагмент тела ответа для сообщения об ошибке.
+
+    response.text декодирует весь буфер целиком; upstream на 5xx может
+    вернуть многомегабайтную HTML-страницу, и она вся оказалась бы в
+    сообщении исключения. Берем первые 512 байт и декодируем с заменой
+    некорректных последовательностей.
+    """
+    return response.content[:512].decode('utf-8', 'replace')
+
+
+def _wrap_upstream_errors(func):
+    """Переводит сетевые и неожиданные ошибки метода в UpstreamError.
+
+    Одна точка трансляции исключений вместо одинакового try/except в каждом
+    методе сервиса. UpstreamError проходит без переупаковки — статусные
+    ошибки (404 и т.п.) сохраняют свой status_code.
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except UpstreamError:
+            raise
+        except httpx.RequestError as e:
+            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
+        except Exception as e:
+            raise UpstreamError(f"Unexpected error: {str(e)}")
+    return wrapper
+
 
 class SCIMProxyService:
     """Сервис для проксирования запросов к upstream SCIM API"""
     
     def __init__(self):
-        self.client: Optional[httpx.AsyncClient] = None
+        # Клиент создается сразу и живет весь жизненный цикл процесса —
+        # методам не нужны проверки инициализации на каждый вызов
+        self.client: httpx.AsyncClient
         self._setup_client()
     
     def _setup_client(self):
         """Настройка HTTP клиента"""
+        settings = get_settings()
         self.client = httpx.AsyncClient(
-            base_url=str(settings.upstream_base_url),
+            # Строковое представление URL кэшировано в константе модуля
+            # config — без повторной сериализации pydantic HttpUrl
+            base_url=UPSTREAM_BASE_URL,
             timeout=settings.upstream_timeout,
-            limits=httpx.Limits(
-                max_connections=settings.upstream_max_connections,
-                max_keepalive_connections=20
+            # Явный транспорт: retries=3 прозрачно повторяет установку
+            # соединения при ConnectError/ConnectTimeout, не сбрасывая пул.
+            # limits и http2 передаются транспорту — при заданном transport
+            # одноименные аргументы клиента не действуют
+            transport=httpx.AsyncHTTPTransport(
+                retries=3,
+                # HTTP/2 мультиплексирует параллельную пагинацию по одному
+                # соединению вместо открытия отдельного сокета на страницу
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=settings.upstream_max_connections,
+                    max_keepalive_connections=20,
+                    # Дефолтные 5с роняют соединение между опросами SCIM-клиентов
+                    # и каждый раз заново гоняют TCP/TLS handshake
+                    keepalive_expiry=15.0
+                ),
             ),
             follow_redirects=True
         )
+        # Backpressure: при всплеске входящего трафика лишние запросы ждут
+        # здесь, а не выстраиваются в очередь за соединениями внутри httpx,
+        # где ожидание съедает общий таймаут запроса
+        self._sem = asyncio.Semaphore(settings.upstream_max_concurrent)
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Выполняет upstream-запрос под семафором ограничения параллелизма.
+
+        Ответы 429/503 повторяются до _RETRY_ATTEMPTS раз: пауза берется из
+        заголовка Retry-After (не более 30с), а без него — экспоненциальный
+        backoff с джиттером. Семафор на время паузы отпускается — upstream
+        попросил подождать, слот не должен простаивать занятым.
+        """
+        for attempt in range(_RETRY_ATTEMPTS + 1):
+            async with self._sem:
+                response = await self.client.request(method, url, **kwargs)
+            if response.status_code not in _RETRY_STATUSES or attempt == _RETRY_ATTEMPTS:
+                return response
+            try:
+                delay = min(float(response.headers["Retry-After"]), 30.0)
+            except (KeyError, ValueError):
+                delay = 0.25 * (2 ** attempt) * (0.5 + random.random())
+            await asyncio.sleep(delay)
+        return response
     
+    async def warmup(self, connections: int = 4):
+        """Прогревает пул соединений к upstream на старте приложения.
+
+        Несколько параллельных запросов заранее выполняют DNS-резолв и
+        TCP/TLS handshake, чтобы первый реальный запрос после деплоя не
+        платил за установку соединения. Ошибки игнорируются — недоступный
+        на старте upstream не должен ронять прокси.
+        """
+        async def ping():
+            try:
+                await self._send("GET", "/ServiceProviderConfig", timeout=5.0)
+            except Exception:
+                pass
+
+        await asyncio.gather(*(ping() for _ in range(connections)))
+
     async def close(self):
         """Закрытие HTTP клиента"""
-        if self.client:
-            await self.client.aclose()
+        await self.client.aclose()
     
+    @_wrap_upstream_errors
     async def get_users(
         self,
         headers: Dict[str, str],
         start_index: int = 1,
         count: int = 100,
         attributes: Optional[List[str]] = None,
-        excluded_attributes: Optional[List[str]] = None
+        excluded_attributes: Optional[List[str]] = None,
+        filter: Optional[str] = None,
+        sort_by: Optional[str] = None,
+        sort_order: Optional[str] = None
     ) -> ListResponse:
         """Получение списка пользователей от upstream API"""
-        
+
         # Подготавливаем параметры запроса
         # НЕ передаем attributes и excludedAttributes в upstream API,
         # так как он их не поддерживает - фильтрация будет на уровне прокси
@@ -52,162 +179,251 @@ class SCIMProxyService:
             "startIndex": start_index,
             "count": count
         }
+
+        # Простые фильтры роутер может делегировать upstream API
+        if filter:
+            params["filter"] = filter
+
+        # Сортировку отдаем upstream: он сортирует весь набор, а не страницу
+        if sort_by:
+            params["sortBy"] = sort_by
+            if sort_order:
+                params["sortOrder"] = sort_order
+        
+        response = await self._send(
+            "GET",
+            _USERS_URL,
+            params=params,
+            headers=self._prepare_headers(headers)
+        )
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-                
-            response = await self.client.get(
-                "/Users",
-                params=params,
-                headers=self._prepare_headers(headers)
+        if response.status_code == 200:
+            try:
+                if TRUST_UPSTREAM:
+                    # Доверенный upstream: модель собирается через
+                    # model_construct без прогона валидаторов по странице
+                    # (валидация остается на пути записи)
+                    return ListResponse.model_construct(**orjson.loads(response.content))
+                # pydantic-core парсит JSON прямо из байт ответа одним
+                # проходом — без промежуточного dict от response.json()
+                return ListResponse.model_validate_json(response.content)
+            except Exception as e:
+                raise UpstreamError(f"Failed to parse upstream response: {str(e)}")
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
             
-            if response.status_code == 200:
-                data = response.json()
-                try:
-                    return ListResponse(**data)
-                except Exception as e:
-                    raise UpstreamError(f"Failed to parse upstream response: {str(e)}")
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            raise UpstreamError(f"Unexpected error: {str(e)}")
-    
     async def get_all_users_for_filtering(
         self,
         headers: Dict[str, str],
         max_results: Optional[int] = None,
         attributes: Optional[List[str]] = None,
         excluded_attributes: Optional[List[str]] = None
-    ) -> List[User]:
+    ) -> List[Dict[str, Any]]:
         """
         Получение всех пользователей для фильтрации.
-        Загружает данные порциями до достижения max_results или конца данных.
+        Первая страница запрашивается отдельно (из нее берется totalResults),
+        остальные — параллельно с ограничением upstream_concurrency: общее
+        время сводится к одному-двум RTT вместо последовательного обхода.
         """
-        from ..config import settings
-        
         if max_results is None:
-            max_results = settings.max_filter_fetch_size
-        
-        all_users = []
-        start_index = 1
+            max_results = MAX_FILTER_FETCH_SIZE
+
         page_size = 100  # Максимальный размер страницы для upstream API
-        
-        while len(all_users) < max_results:
+
+        try:
+            first_page = await self.get_users(
+                headers=headers,
+                start_index=1,
+                count=page_size,
+                attributes=attributes,
+                excluded_attributes=excluded_attributes
+            )
+        except UpstreamError:
+            return []
+
+        all_users = list(first_page.Resources)
+
+        # Данные закончились на первой странице
+        if not all_users or len(all_users) < page_size:
+            return all_users[:max_results]
+
+        # Сколько записей реально нужно забрать
+        target = max_results
+        if first_page.totalResults:
+            target = min(target, first_page.totalResults)
+        if len(all_users) >= target:
+            return all_users[:max_results]
+
+        semaphore = asyncio.Semaphore(get_settings().upstream_concurrency)
+
+        async def fetch_page(page_start: int) -> List[Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    response = await self.get_users(
+                        headers=headers,
+                        start_index=page_start,
+                        count=page_size,
+                        attributes=attributes,
+                        excluded_attributes=excluded_attributes
+                    )
+                    return response.Resources
+                except UpstreamError:
+                    # Ошибка на промежуточной странице — возвращаем что есть
+                    return []
+
+        page_starts = range(1 + page_size, target + 1, page_size)
+        pages = await asyncio.gather(*(fetch_page(start) for start in page_starts))
+        for page in pages:
+            all_users.extend(page)
+
+        return all_users[:max_results]
+
+    async def iter_users_for_filtering(
+        self,
+        headers: Dict[str, str],
+        max_results: Optional[int] = None,
+        attributes: Optional[List[str]] = None,
+        excluded_attributes: Optional[List[str]] = None
+    ):
+        """Асинхронный генератор страниц пользователей для потоковой фильтрации.
+
+        Следующая страница запрашивается параллельно с обработкой текущей
+        (предвыборка на одну страницу вперед), а ранний выход вызывающего
+        кода останавливает дальнейшие запросы к upstream.
+        """
+        if max_results is None:
+            max_results = MAX_FILTER_FETCH_SIZE
+
+        page_size = 100  # Максимальный размер страницы для upstream API
+        start_index = 1
+        fetched = 0
+
+        async def fetch_page(page_start: int) -> Optional[ListResponse]:
             try:
-                # Запрашиваем следующую порцию
-                response = await self.get_users(
+                return await self.get_users(
                     headers=headers,
-                    start_index=start_index,
+                    start_index=page_start,
                     count=page_size,
                     attributes=attributes,
                     excluded_attributes=excluded_attributes
                 )
-                
-                # Если нет данных, прекращаем
-                if not response.Resources:
-                    break
-                
-                # Добавляем пользователей
-                all_users.extend(response.Resources)
-                
-                # Если получили меньше чем запрашивали, значит данные закончились
-                if len(response.Resources) < page_size:
+            except UpstreamError:
+                # Ошибка на промежуточной странице — отдаем что успели
+                return None
+
+        pending = asyncio.ensure_future(fetch_page(start_index))
+        try:
+            while True:
+                response = await pending
+                pending = None
+                if response is None or not response.Resources:
                     break
-                
-                # Если достигли общего количества записей в upstream API
-                if response.totalResults and len(all_users) >= response.totalResults:
+
+                resources = response.Resources[:max_results - fetched]
+                fetched += len(resources)
+
+                has_more = (
+                    len(response.Resources) == page_size
+                    and fetched < max_results
+                    and not (response.totalResults and fetched >= response.totalResults)
+                )
+                if has_more:
+                    start_index += page_size
+                    pending = asyncio.ensure_future(fetch_page(start_index))
+
+                yield resources
+
+                if not has_more:
                     break
-                
-                start_index += page_size
-                
-            except UpstreamError:
-                # Если ошибка на промежуточной странице, возвращаем что есть
-                break
-        
-        return all_users[:max_results]
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
     
+    @_wrap_upstream_errors
     async def get_user(self, user_id: str, headers: Dict[str, str]) -> User:
         """Получение пользователя по ID от upstream API"""
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-                
-            response = await self.client.get(
-                f"/Users/{user_id}",
-                headers=self._prepare_headers(headers)
+        response = await self._send(
+            "GET",
+            _USER_ID_TMPL % quote(user_id, safe=""),
+            headers=self._prepare_headers(headers)
+        )
+        
+        if response.status_code == 200:
+            return User.model_validate_json(response.content)
+        elif response.status_code == 404:
+            raise UpstreamError(f"User {user_id} not found", status_code=404)
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return User(**data)
-            elif response.status_code == 404:
-                raise UpstreamError(f"User {user_id} not found", status_code=404)
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            raise UpstreamError(f"Unexpected error: {str(e)}")
     
+    @_wrap_upstream_errors
     async def create_user(self, user_data: Dict[str, Any], headers: Dict[str, str]) -> User:
         """Создание пользователя через upstream API"""
         
         logger = logging.getLogger(__name__)
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-            
-            prepared_headers = self._prepare_headers(headers, content_type="application/scim+json")
-            masked_headers = self._mask_sensitive_headers(prepared_headers)
+        prepared_headers = self._prepare_headers(headers, content_type="application/scim+json")
+        masked_headers = self._mask_sensitive_headers(prepared_headers)
+        
+        logger.info(f"Sending POST request to create user")
+        logger.info(f"Request URL: /Users")
+        logger.info(f"Request headers: {masked_headers}")
+        logger.debug(f"Request body: {user_data}")
             
-            logger.info(f"Sending POST request to create user")
-            logger.info(f"Request URL: /Users")
-            logger.info(f"Request headers: {masked_headers}")
-            logger.debug(f"Request body: {user_data}")
-                
-            response = await self.client.post(
-                "/Users",
-                json=user_data,
-                headers=prepared_headers
+        response = await self._send(
+            "POST",
+            _USERS_URL,
+            content=orjson.dumps(user_data),
+            headers=prepared_headers
+        )
+        
+        logger.info(f"Upstream API response status: {response.status_code}")
+        
+        if self._should_log_response_body(logger):
+            logger.debug(f"Upstream API response body: {response.text}")
+        elif response.status_code >= 400:
+            logger.error(f"Upstream API error response: {response.text}")
+        
+        status = response.status_code
+        if status == 201 or status == 200:
+            return User.model_validate_json(response.content)
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
-            
-            logger.info(f"Upstream API response status: {response.status_code}")
-            
-            if self._should_log_response_body(logger):
-                logger.debug(f"Upstream API response body: {response.text}")
-            elif response.status_code >= 400:
-                logger.error(f"Upstream API error response: {response.text}")
-            
-            if response.status_code in [201, 200]:
-                data = response.json()
-                return User(**data)
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            logger.error(f"HTTP request error for create user: {str(e)}")
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            logger.error(f"Unexpected error in create_user: {str(e)}", exc_info=True)
-            raise UpstreamError(f"Unexpected error: {str(e)}")
     
+    async def create_users_bulk(
+        self,
+        users: List[Dict[str, Any]],
+        headers: Dict[str, str],
+        concurrency: int = 16
+    ) -> List[Union[User, UpstreamError]]:
+        """Параллельное создание пользователей с ограничением конкуренции.
+
+        Запросы уходят пачкой через общий клиент (HTTP/2 мультиплексирует их
+        по одному соединению), порядок результатов соответствует порядку
+        входных данных. Ошибка по одному пользователю не прерывает остальных —
+        в соответствующей позиции возвращается UpstreamError.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def create_one(user_data: Dict[str, Any]) -> User:
+            async with semaphore:
+                return await self.create_user(user_data, headers)
+
+        return await asyncio.gather(
+            *(create_one(user) for user in users),
+            return_exceptions=True
+        )
+
+    @_wrap_upstream_errors
     async def update_user(
         self,
         user_id: str,
@@ -218,49 +434,38 @@ class SCIMProxyService:
         
         logger = logging.getLogger(__name__)
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-            
-            prepared_headers = self._prepare_headers(headers, content_type="application/scim+json")
-            masked_headers = self._mask_sensitive_headers(prepared_headers)
+        prepared_headers = self._prepare_headers(headers, content_type="application/scim+json")
+        masked_headers = self._mask_sensitive_headers(prepared_headers)
+        
+        logger.info(f"Sending PUT request to update user {user_id}")
+        logger.info(f"Request URL: /Users/{user_id}")
+        logger.info(f"Request headers: {masked_headers}")
+        logger.debug(f"Request body: {user_data}")
             
-            logger.info(f"Sending PUT request to update user {user_id}")
-            logger.info(f"Request URL: /Users/{user_id}")
-            logger.info(f"Request headers: {masked_headers}")
-            logger.debug(f"Request body: {user_data}")
-                
-            response = await self.client.put(
-                f"/Users/{user_id}",
-                json=user_data,
-                headers=prepared_headers
+        response = await self._send(
+            "PUT",
+            _USER_ID_TMPL % quote(user_id, safe=""),
+            content=orjson.dumps(user_data),
+            headers=prepared_headers
+        )
+        
+        logger.info(f"Upstream API response status: {response.status_code}")
+        
+        if self._should_log_response_body(logger):
+            logger.debug(f"Upstream API response body: {response.text}")
+        elif response.status_code >= 400:
+            logger.error(f"Upstream API error response: {response.text}")
+        
+        if response.status_code == 200:
+            return User.model_validate_json(response.content)
+        elif response.status_code == 404:
+            raise UpstreamError(f"User {user_id} not found", status_code=404)
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
             
-            logger.info(f"Upstream API response status: {response.status_code}")
-            
-            if self._should_log_response_body(logger):
-                logger.debug(f"Upstream API response body: {response.text}")
-            elif response.status_code >= 400:
-                logger.error(f"Upstream API error response: {response.text}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                return User(**data)
-            elif response.status_code == 404:
-                raise UpstreamError(f"User {user_id} not found", status_code=404)
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            logger.error(f"HTTP request error for user {user_id}: {str(e)}")
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            logger.error(f"Unexpected error in update_user for user {user_id}: {str(e)}", exc_info=True)
-            raise UpstreamError(f"Unexpected error: {str(e)}")
-    
     def _mask_sensitive_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
         """Маскирует чувствительные данные в заголовках для логирования"""
         masked_headers = {}
@@ -281,6 +486,7 @@ class SCIMProxyService:
         """Определяет, нужно ли логировать тело ответа (только в DEBUG режиме)"""
         return logger.isEnabledFor(logging.DEBUG)
     
+    @_wrap_upstream_errors
     async def patch_user(
         self,
         user_id: str,
@@ -292,134 +498,197 @@ class SCIMProxyService:
         import logging
         logger = logging.getLogger(__name__)
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-            
-            # Подробное логирование запроса
-            prepared_headers = self._prepare_headers(headers, content_type="application/scim+json")
-            masked_headers = self._mask_sensitive_headers(prepared_headers)
+        # Подробное логирование запроса
+        prepared_headers = self._prepare_headers(headers, content_type="application/scim+json")
+        masked_headers = self._mask_sensitive_headers(prepared_headers)
+        
+        logger.info(f"Sending PATCH request to upstream API for user {user_id}")
+        logger.info(f"Request URL: /Users/{user_id}")
+        logger.info(f"Request headers: {masked_headers}")
+        logger.info(f"Request body: {patch_data}")
             
-            logger.info(f"Sending PATCH request to upstream API for user {user_id}")
-            logger.info(f"Request URL: /Users/{user_id}")
-            logger.info(f"Request headers: {masked_headers}")
-            logger.info(f"Request body: {patch_data}")
-                
-            response = await self.client.patch(
-                f"/Users/{user_id}",
-                json=patch_data,
-                headers=prepared_headers
+        response = await self._send(
+            "PATCH",
+            _USER_ID_TMPL % quote(user_id, safe=""),
+            content=orjson.dumps(patch_data),
+            headers=prepared_headers
+        )
+        
+        # Логируем ответ
+        logger.info(f"Upstream API response status: {response.status_code}")
+        
+        # Логируем тело ответа только в DEBUG режиме
+        if self._should_log_response_body(logger):
+            logger.debug(f"Upstream API response body: {response.text}")
+        elif response.status_code >= 400:
+            # Всегда логируем ошибки
+            logger.error(f"Upstream API error response: {response.text}")
+        
+        if response.status_code == 200:
+            return User.model_validate_json(response.content)
+        elif response.status_code == 404:
+            raise UpstreamError(f"User {user_id} not found", status_code=404)
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
-            
-            # Логируем ответ
-            logger.info(f"Upstream API response status: {response.status_code}")
-            
-            # Логируем тело ответа только в DEBUG режиме
-            if self._should_log_response_body(logger):
-                logger.debug(f"Upstream API response body: {response.text}")
-            elif response.status_code >= 400:
-                # Всегда логируем ошибки
-                logger.error(f"Upstream API error response: {response.text}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                return User(**data)
-            elif response.status_code == 404:
-                raise UpstreamError(f"User {user_id} not found", status_code=404)
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            logger.error(f"HTTP request error for user {user_id}: {str(e)}")
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            logger.error(f"Unexpected error in patch_user for user {user_id}: {str(e)}", exc_info=True)
-            raise UpstreamError(f"Unexpected error: {str(e)}")
     
+    @_wrap_upstream_errors
     async def delete_user(self, user_id: str, headers: Dict[str, str]) -> bool:
         """Удаление пользователя через upstream API"""
-        
+
+        # Потоковый запрос: на успешном пути важен только статус, тело
+        # читается лишь тогда, когда попадает в сообщение об ошибке
+        request = self.client.build_request(
+            "DELETE",
+            _USER_ID_TMPL % quote(user_id, safe=""),
+            headers=self._prepare_headers(headers)
+        )
+        async with self._sem:
+            response = await self.client.send(request, stream=True)
         try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-                
-            response = await self.client.delete(
-                f"/Users/{user_id}",
-                headers=self._prepare_headers(headers)
-            )
-            
             if response.status_code == 204:
                 return True
             elif response.status_code == 404:
                 raise UpstreamError(f"User {user_id} not found", status_code=404)
             else:
+                await response.aread()
                 raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
+                    f"Upstream API returned {response.status_code}: {_err_preview(response)}",
                     status_code=response.status_code
                 )
-                
-        except httpx.RequestError as e:
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            raise UpstreamError(f"Unexpected error: {str(e)}")
-    
+        finally:
+            await response.aclose()
+            
     async def get_all_groups_for_filtering(
         self,
         headers: Dict[str, str],
         max_results: Optional[int] = None,
         attributes: Optional[List[str]] = None,
         excluded_attributes: Optional[List[str]] = None
-    ) -> List[Group]:
+    ) -> List[Dict[str, Any]]:
         """
         Получение всех групп для фильтрации.
-        Загружает данные порциями до достижения max_results или конца данных.
+        Первая страница запрашивается отдельно (из нее берется totalResults),
+        остальные — параллельно с ограничением upstream_concurrency, как в
+        get_all_users_for_filtering.
         """
-        from ..config import settings
-        
         if max_results is None:
-            max_results = settings.max_filter_fetch_size
-        
-        all_groups = []
-        start_index = 1
+            max_results = MAX_FILTER_FETCH_SIZE
+
         page_size = 100  # Максимальный размер страницы для upstream API
-        
-        while len(all_groups) < max_results:
+
+        try:
+            first_page = await self.get_groups(
+                headers=headers,
+                start_index=1,
+                count=page_size,
+                attributes=attributes,
+                excluded_attributes=excluded_attributes
+            )
+        except UpstreamError:
+            return []
+
+        all_groups = list(first_page.Resources)
+
+        # Данные закончились на первой странице
+        if not all_groups or len(all_groups) < page_size:
+            return all_groups[:max_results]
+
+        # Сколько записей реально нужно забрать
+        target = max_results
+        if first_page.totalResults:
+            target = min(target, first_page.totalResults)
+        if len(all_groups) >= target:
+            return all_groups[:max_results]
+
+        semaphore = asyncio.Semaphore(get_settings().upstream_concurrency)
+
+        async def fetch_page(page_start: int) -> List[Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    response = await self.get_groups(
+                        headers=headers,
+                        start_index=page_start,
+                        count=page_size,
+                        attributes=attributes,
+                        excluded_attributes=excluded_attributes
+                    )
+                    return response.Resources
+                except UpstreamError:
+                    # Ошибка на промежуточной странице — возвращаем что есть
+                    return []
+
+        page_starts = range(1 + page_size, target + 1, page_size)
+        pages = await asyncio.gather(*(fetch_page(start) for start in page_starts))
+        for page in pages:
+            all_groups.extend(page)
+
+        return all_groups[:max_results]
+    
+    async def iter_groups_for_filtering(
+        self,
+        headers: Dict[str, str],
+        max_results: Optional[int] = None,
+        attributes: Optional[List[str]] = None,
+        excluded_attributes: Optional[List[str]] = None
+    ):
+        """Асинхронный генератор страниц групп для потоковой фильтрации.
+
+        Зеркало iter_users_for_filtering: следующая страница запрашивается
+        параллельно с обработкой текущей, ранний выход вызывающего кода
+        останавливает дальнейшие запросы к upstream.
+        """
+        if max_results is None:
+            max_results = MAX_FILTER_FETCH_SIZE
+
+        page_size = 100  # Максимальный размер страницы для upstream API
+        start_index = 1
+        fetched = 0
+
+        async def fetch_page(page_start: int) -> Optional[GroupListResponse]:
             try:
-                # Запрашиваем следующую порцию
-                response = await self.get_groups(
+                return await self.get_groups(
                     headers=headers,
-                    start_index=start_index,
+                    start_index=page_start,
                     count=page_size,
                     attributes=attributes,
                     excluded_attributes=excluded_attributes
                 )
-                
-                # Если нет данных, прекращаем
-                if not response.Resources:
-                    break
-                
-                # Добавляем группы
-                all_groups.extend(response.Resources)
-                
-                # Если получили меньше чем запрашивали, значит данные закончились
-                if len(response.Resources) < page_size:
+            except UpstreamError:
+                # Ошибка на промежуточной странице — отдаем что успели
+                return None
+
+        pending = asyncio.ensure_future(fetch_page(start_index))
+        try:
+            while True:
+                response = await pending
+                pending = None
+                if response is None or not response.Resources:
                     break
-                
-                # Если достигли общего количества записей в upstream API
-                if response.totalResults and len(all_groups) >= response.totalResults:
+
+                resources = response.Resources[:max_results - fetched]
+                fetched += len(resources)
+
+                has_more = (
+                    len(response.Resources) == page_size
+                    and fetched < max_results
+                    and not (response.totalResults and fetched >= response.totalResults)
+                )
+                if has_more:
+                    start_index += page_size
+                    pending = asyncio.ensure_future(fetch_page(start_index))
+
+                yield resources
+
+                if not has_more:
                     break
-                
-                start_index += page_size
-                
-            except UpstreamError:
-                # Если ошибка на промежуточной странице, возвращаем что есть
-                break
-        
-        return all_groups[:max_results]
-    
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+
+    @_wrap_upstream_errors
     async def get_groups(
         self,
         headers: Dict[str, str],
@@ -438,88 +707,67 @@ class SCIMProxyService:
             "count": count
         }
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-                
-            response = await self.client.get(
-                "/Groups",
-                params=params,
-                headers=self._prepare_headers(headers)
+        response = await self._send(
+            "GET",
+            _GROUPS_URL,
+            params=params,
+            headers=self._prepare_headers(headers)
+        )
+        
+        if response.status_code == 200:
+            try:
+                if TRUST_UPSTREAM:
+                    return GroupListResponse.model_construct(**orjson.loads(response.content))
+                return GroupListResponse.model_validate_json(response.content)
+            except Exception as e:
+                raise UpstreamError(f"Failed to parse upstream response: {str(e)}")
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                try:
-                    return GroupListResponse(**data)
-                except Exception as e:
-                    raise UpstreamError(f"Failed to parse upstream response: {str(e)}")
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            raise UpstreamError(f"Unexpected error: {str(e)}")
     
+    @_wrap_upstream_errors
     async def get_group(self, group_id: str, headers: Dict[str, str]) -> Group:
         """Получение группы по ID от upstream API"""
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-                
-            response = await self.client.get(
-                f"/Groups/{group_id}",
-                headers=self._prepare_headers(headers)
+        response = await self._send(
+            "GET",
+            _GROUP_ID_TMPL % quote(group_id, safe=""),
+            headers=self._prepare_headers(headers)
+        )
+        
+        if response.status_code == 200:
+            return Group.model_validate_json(response.content)
+        elif response.status_code == 404:
+            raise UpstreamError(f"Group {group_id} not found", status_code=404)
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return Group(**data)
-            elif response.status_code == 404:
-                raise UpstreamError(f"Group {group_id} not found", status_code=404)
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            raise UpstreamError(f"Unexpected error: {str(e)}")
     
+    @_wrap_upstream_errors
     async def create_group(self, group_data: Dict[str, Any], headers: Dict[str, str]) -> Group:
         """Создание группы через upstream API"""
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-                
-            response = await self.client.post(
-                "/Groups",
-                json=group_data,
-                headers=self._prepare_headers(headers, content_type="application/scim+json")
+        response = await self._send(
+            "POST",
+            _GROUPS_URL,
+            content=orjson.dumps(group_data),
+            headers=self._prepare_headers(headers, content_type="application/scim+json")
+        )
+        
+        status = response.status_code
+        if status == 201 or status == 200:
+            return Group.model_validate_json(response.content)
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
-            
-            if response.status_code in [201, 200]:
-                data = response.json()
-                return Group(**data)
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            raise UpstreamError(f"Unexpected error: {str(e)}")
     
+    @_wrap_upstream_errors
     async def update_group(
         self,
         group_id: str,
@@ -528,32 +776,24 @@ class SCIMProxyService:
     ) -> Group:
         """Полное обновление группы через upstream API"""
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-                
-            response = await self.client.put(
-                f"/Groups/{group_id}",
-                json=group_data,
-                headers=self._prepare_headers(headers, content_type="application/scim+json")
+        response = await self._send(
+            "PUT",
+            _GROUP_ID_TMPL % quote(group_id, safe=""),
+            content=orjson.dumps(group_data),
+            headers=self._prepare_headers(headers, content_type="application/scim+json")
+        )
+        
+        if response.status_code == 200:
+            return Group.model_validate_json(response.content)
+        elif response.status_code == 404:
+            raise UpstreamError(f"Group {group_id} not found", status_code=404)
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return Group(**data)
-            elif response.status_code == 404:
-                raise UpstreamError(f"Group {group_id} not found", status_code=404)
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            raise UpstreamError(f"Unexpected error: {str(e)}")
     
+    @_wrap_upstream_errors
     async def patch_group(
         self,
         group_id: str,
@@ -562,93 +802,67 @@ class SCIMProxyService:
     ) -> Group:
         """Частичное обновление группы через upstream API"""
         
-        try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-                
-            response = await self.client.patch(
-                f"/Groups/{group_id}",
-                json=patch_data,
-                headers=self._prepare_headers(headers, content_type="application/scim+json")
+        response = await self._send(
+            "PATCH",
+            _GROUP_ID_TMPL % quote(group_id, safe=""),
+            content=orjson.dumps(patch_data),
+            headers=self._prepare_headers(headers, content_type="application/scim+json")
+        )
+        
+        if response.status_code == 200:
+            return Group.model_validate_json(response.content)
+        elif response.status_code == 404:
+            raise UpstreamError(f"Group {group_id} not found", status_code=404)
+        else:
+            raise UpstreamError(
+                f"Upstream API returned {response.status_code}: {_err_preview(response)}",
+                status_code=response.status_code
             )
-            
-            if response.status_code == 200:
-                data = response.json()
-                return Group(**data)
-            elif response.status_code == 404:
-                raise UpstreamError(f"Group {group_id} not found", status_code=404)
-            else:
-                raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
-                    status_code=response.status_code
-                )
-                
-        except httpx.RequestError as e:
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            raise UpstreamError(f"Unexpected error: {str(e)}")
     
+    @_wrap_upstream_errors
     async def delete_group(self, group_id: str, headers: Dict[str, str]) -> bool:
         """Удаление группы через upstream API"""
-        
+
+        # Потоковый запрос: тело читается только для сообщения об ошибке
+        request = self.client.build_request(
+            "DELETE",
+            _GROUP_ID_TMPL % quote(group_id, safe=""),
+            headers=self._prepare_headers(headers)
+        )
+        async with self._sem:
+            response = await self.client.send(request, stream=True)
         try:
-            if not self.client:
-                raise UpstreamError("HTTP client not initialized")
-                
-            response = await self.client.delete(
-                f"/Groups/{group_id}",
-                headers=self._prepare_headers(headers)
-            )
-            
             if response.status_code == 204:
                 return True
             elif response.status_code == 404:
                 raise UpstreamError(f"Group {group_id} not found", status_code=404)
             else:
+                await response.aread()
                 raise UpstreamError(
-                    f"Upstream API returned {response.status_code}: {response.text}",
+                    f"Upstream API returned {response.status_code}: {_err_preview(response)}",
                     status_code=response.status_code
                 )
-                
-        except httpx.RequestError as e:
-            raise UpstreamError(f"Request to upstream API failed: {str(e)}")
-        except Exception as e:
-            raise UpstreamError(f"Unexpected error: {str(e)}")
-    
+        finally:
+            await response.aclose()
+            
     def _prepare_headers(
         self,
         original_headers: Dict[str, str],
         content_type: Optional[str] = None
     ) -> Dict[str, str]:
         """Подготавливает заголовки для upstream запроса"""
-        
-        # Копируем все заголовки аутентификации и авторизации
-        headers = {}
-        
-        # Важные заголовки для проксирования
-        important_headers = [
-            'authorization',
-            'x-api-key',
-            'x-auth-token',
-            'bearer',
-            'cookie',
-            'x-forwarded-for',
-            'x-real-ip',
-            'user-agent'
-        ]
-        
-        for key, value in original_headers.items():
-            if key.lower() in important_headers:
-                headers[key] = value
-        
+
+        # Заголовки по умолчанию, поверх них — важные заголовки запроса
+        # (аутентификация и авторизация)
+        headers = {
+            **_DEFAULT_HEADERS,
+            **{k: v for k, v in original_headers.items() if k.lower() in _IMPORTANT_HEADERS},
+        }
+
         # Устанавливаем Content-Type если указан
         if content_type:
             headers['Content-Type'] = content_type
-        
-        # Добавляем заголовки по умолчанию
-        headers.setdefault('Accept', 'application/scim+json')
-        headers.setdefault('User-Agent', 'SCIM-Proxy/1.0.0')
-        
+
         return headers
 
 